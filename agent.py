@@ -1,16 +1,13 @@
-from langchain.agents import AgentExecutor, Tool
-from langchain.chains import LLMChain
-from langchain.vectorstores import Qdrant
-from langchain_openai import ChatOpenAI
 import retrieval as re
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, Range, MatchValue, MatchAny
-import api
-import numpy as np
-
-def retrieve_country_policies(country_name: str, query: str, collection, year_threshold:int, k=50):
-    years = [str(year) for year in range(year_threshold, 2100)]
-
+import config
+import context_builder as cb
+import chatbot
+import instrumentation as inst
+import clients
+from concurrent.futures import ThreadPoolExecutor
+
+def country_policy_passages(country_name: str, query: str, collection, year_threshold:int, k=50):
+    from qdrant_client.http.models import Filter, FieldCondition, Range, MatchValue
     filter = Filter(
         must=[
             FieldCondition(
@@ -18,8 +15,8 @@ def retrieve_country_policies(country_name: str, query: str, collection, year_th
                 match=MatchValue(value=country_name)
             ),
             FieldCondition(
-                key="year",
-                match=MatchAny(any=years),
+                key="year_number",
+                range=Range(gte=year_threshold),
             )
         ]
     )
@@ -28,23 +25,22 @@ def retrieve_country_policies(country_name: str, query: str, collection, year_th
     retriever.similarity_search_with_filter(k, filter)
     # retriever.rerank(['policy', 'effect'])
     # retriever.cos_filtering(['policy', 'effect'], 0.8, 30)
-    retriever.filtered_countents = retriever.found_docs
-    context = " "
-    for filtered_context in retriever.filtered_contents:
-        context += filtered_context
-    
-    return context
+    return retriever.passages(['policy', 'effect'])
 
-def retrieve_knowledge(query: str, collection, k=50):
+def knowledge_passages(query: str, collection, k=50):
     retriever = re.Retriever(query, collection)
     retriever.similarity_search(k)
     # retriever.rerank('content')
     # retriever.cos_filtering('content', 0.8, 30)
+    return retriever.passages('content')
 
-    context = " "
-    for filtered_context in retriever.filtered_contents:
-        context += filtered_context
-    
+def retrieve_country_policies(country_name: str, query: str, collection, year_threshold:int, k=50, max_tokens=None):
+    passages = country_policy_passages(country_name, query, collection, year_threshold, k)
+    context, _ = cb.pack(passages, max_tokens or config.context_token_budget)
+    return context
+
+def retrieve_knowledge(query: str, collection, k=50, max_tokens=None):
+    context, _ = cb.pack(knowledge_passages(query, collection, k), max_tokens or config.context_token_budget)
     return context
 
 class CountryAgent:
@@ -53,10 +49,15 @@ class CountryAgent:
         self.llm = llm
         self.policy_memory = []
         self.stance = stance if stance else "balanced approach"
+        self.prompt_tokens = []
 
-    def propose_policy(self, shared_goal, policy_collection, knowledge_collection, year):
-        retrieved_policies = retrieve_country_policies(self.country_name, shared_goal, policy_collection, year)
-        retrieved_knowledges = retrieve_knowledge(shared_goal, knowledge_collection)
+    def proposal_prompt(self, shared_goal, policy_collection, knowledge_collection, year, retrieved_knowledges=None, context_budget=None):
+        policies = country_policy_passages(self.country_name, shared_goal, policy_collection, year)
+        if retrieved_knowledges is None:
+            retrieved_knowledges = knowledge_passages(shared_goal, knowledge_collection)
+        contexts, report = cb.build_context({"policies": policies, "knowledge": retrieved_knowledges}, context_budget)
+        retrieved_policies = contexts["policies"]
+        retrieved_knowledges = contexts["knowledge"]
 
         prompt = f"""
         You are the policy advisor for {self.country_name}, which has a {self.stance}.
@@ -74,10 +75,32 @@ class CountryAgent:
         You may also highlight any points of potential contention or 
         unique considerations for {self.country_name}.
         """
+        self.prompt_tokens.append(cb.count_tokens(prompt))
+        print(f"{self.country_name} proposal prompt: {self.prompt_tokens[-1]} tokens ({report['tokens']} from context)")
+        return prompt
+
+    @inst.timed("agent.propose_policy")
+    def propose_policy(self, shared_goal, policy_collection, knowledge_collection, year, retrieved_knowledges=None, context_budget=None):
+        prompt = self.proposal_prompt(shared_goal, policy_collection, knowledge_collection, year, retrieved_knowledges, context_budget)
         response = self.llm(prompt)
+        inst.record_usage("agent.propose_policy", response)
         self.policy_memory.append(response.content)
         return response.content
+
+    def stream_proposal(self, shared_goal, policy_collection, knowledge_collection, year, retrieved_knowledges=None, context_budget=None, stats=None):
+        prompt = self.proposal_prompt(shared_goal, policy_collection, knowledge_collection, year, retrieved_knowledges, context_budget)
+        stats = stats if stats is not None else chatbot.StreamStats()
+        stats._started()
+        parts = []
+        for chunk in self.llm.stream(prompt):
+            if chunk.content:
+                stats._received()
+                parts.append(chunk.content)
+                yield chunk.content
+        stats._finished()
+        self.policy_memory.append("".join(parts))
     
+    @inst.timed("agent.react_to_other_policies")
     def react_to_other_policies(self, other_policies):
         prompt = f"""
         You are {self.country_name}'s policy advisor, with a {self.stance}.
@@ -93,35 +116,49 @@ class CountryAgent:
         3. Provide a clear statement of how your revised policy stands in contrast 
            or alignment with the others.
         """
+        self.prompt_tokens.append(cb.count_tokens(prompt))
         response = self.llm(prompt)
+        inst.record_usage("agent.react_to_other_policies", response)
         self.policy_memory.append(response)
         return response
 
-def multi_agent_climate_discussion(countries, shared_goal, policy_collection, knowledge_collection, year, stances=None):
+def multi_agent_climate_discussion(countries, shared_goal, policy_collection, knowledge_collection, year, stances=None, rounds=1, max_workers=None):
     """
     stances: A dictionary mapping each country to a specific stance string (optional).
              Example: {'USA': 'strong oil & gas interests', 'France': 'nuclear energy focus'}
+    rounds: Number of debate rounds after the proposals. Within a round all agents react
+            concurrently to the same snapshot of the other countries' proposals.
     """
-    llm = ChatOpenAI(model='gpt-4o-mini', temperature=0.7, api_key=api.OPENAI_API)
+    llm = clients.chat_model(temperature=0.7)
 
     agents = []
     for country in countries:
         stance = stances.get(country, None) if stances else None
         agents.append(CountryAgent(country, llm, stance=stance))
 
-    proposals = {}
-    for agent in agents:
-        proposals[agent.country_name] = agent.propose_policy(shared_goal, policy_collection, knowledge_collection, year)
+    # The shared goal is the same query for every agent, so its knowledge is retrieved once.
+    retrieved_knowledges = knowledge_passages(shared_goal, knowledge_collection)
 
-    for agent in agents:
-        other_proposals_text = "\n".join(
-            f"{cntry} proposed: {prop}" for cntry, prop in proposals.items() if cntry != agent.country_name
+    with ThreadPoolExecutor(max_workers=max_workers or config.agent_concurrency) as pool:
+        proposed = pool.map(
+            lambda agent: agent.propose_policy(shared_goal, policy_collection, knowledge_collection, year, retrieved_knowledges),
+            agents
         )
-        reaction = agent.react_to_other_policies(other_proposals_text)
-        proposals[agent.country_name] += "\n\nREVISED PROPOSAL:\n" + reaction.content
+        proposals = dict(zip((agent.country_name for agent in agents), proposed))
+
+        for _ in range(rounds):
+            snapshot = dict(proposals)
+            reactions = pool.map(
+                lambda agent: agent.react_to_other_policies("\n".join(
+                    f"{cntry} proposed: {prop}" for cntry, prop in snapshot.items() if cntry != agent.country_name
+                )),
+                agents
+            )
+            for agent, reaction in zip(agents, reactions):
+                proposals[agent.country_name] += "\n\nREVISED PROPOSAL:\n" + reaction.content
 
     result_dict = {}
     for country, final_policy_text in proposals.items():
         result_dict[country] = final_policy_text
 
-    return result_dict
\ No newline at end of file
+    return result_dict
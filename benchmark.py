@@ -0,0 +1,325 @@
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import subprocess
+import numpy as np
+import config
+import fakes
+import instrumentation as inst
+import clients
+
+COUNTRIES = ["Canada", "France", "Germany", "Italy", "Japan", "United Kingdom", "United States"]
+TOPICS = [
+    "carbon tax", "renewable energy", "emissions trading", "coal phase-out", "electric vehicles",
+    "energy efficiency", "methane regulation", "forest protection", "green hydrogen", "climate finance",
+]
+WORDS = (
+    "policy target reduce emissions percent sector industry transport buildings power grid investment "
+    "subsidy standard regulation market national plan strategy adaptation mitigation resilience "
+    "agriculture land use support households innovation research jobs transition"
+).split()
+
+# Importing a pipeline module must not pull these in; they load on first use.
+HEAVY_MODULES = [
+    "openai", "qdrant_client", "langchain_qdrant", "langchain_openai", "langchain",
+    "llama_index", "sentence_transformers", "torch", "fastembed", "fitz",
+]
+IMPORT_MODULES = ["pdf", "vector_store", "retrieval", "chatbot", "agent", "rag", "semantic_cache", "chunk_store"]
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+def synthetic_policies(size, seed=0):
+    generator = random.Random(seed)
+    policies = []
+    for i in range(size):
+        topic = generator.choice(TOPICS)
+        policies.append({
+            "policy_id": f"synthetic-{i}",
+            "policy": f"{topic.capitalize()} " + " ".join(generator.choice(WORDS) for _ in range(30)),
+            "effect": " ".join(generator.choice(WORDS) for _ in range(20)),
+            "country": generator.choice(COUNTRIES),
+            "year": str(generator.randint(1995, 2030)),
+        })
+    return policies
+
+def synthetic_queries(size, seed=1):
+    generator = random.Random(seed)
+    return [f"What {generator.choice(TOPICS)} policy did {generator.choice(COUNTRIES)} adopt to {generator.choice(WORDS)} emissions?" for _ in range(size)]
+
+def setup(args):
+    import vector_store as vs
+    import model_registry as mr
+
+    config.embedding_cache_enabled = False
+    openai = fakes.FakeOpenAI(latency=args.embedding_latency, token_latency=args.token_latency, dim=args.dim)
+    sparse_model = fakes.FakeSparseModel()
+    clients.set_client("openai", openai)
+    if args.backend == "local":
+        client = vs.set_backend("local", args.local_path)
+    else:
+        from qdrant_client import QdrantClient
+        client = vs.set_backend("memory", client=QdrantClient(":memory:"))
+    mr.registry.register("splade", lambda name: sparse_model, "fake-splade")
+    mr.registry.register("fastembed_sparse", lambda name: sparse_model, "fake-splade")
+    mr.registry.register("cross_encoder", lambda name: fakes.FakeCrossEncoder(args.rerank_latency), "fake-cross-encoder")
+    return vs, client, openai, sparse_model
+
+def bench_ingestion(vs, client, openai, sparse_model, policies, args):
+    vs.create_collection(args.collection, args.dim, client=client)
+    start = time.perf_counter()
+    vs.add_policies(policies, args.collection, client=client, embedding_client=openai, sparse_model=sparse_model, cache=False)
+    elapsed = time.perf_counter() - start
+    return {"items": len(policies), "seconds": elapsed, "items_per_second": len(policies) / elapsed if elapsed else 0.0}
+
+def get_collection(vs, client, openai, sparse_model, args):
+    from langchain_core.embeddings import Embeddings
+    from langchain_qdrant import QdrantVectorStore, RetrievalMode, SparseEmbeddings, SparseVector
+
+    class DenseAdapter(Embeddings):
+        def __init__(self):
+            self.fake = fakes.FakeDenseEmbeddings(openai)
+
+        def embed_documents(self, texts):
+            return self.fake.embed_documents(texts)
+
+        def embed_query(self, text):
+            return self.fake.embed_query(text)
+
+    class SparseAdapter(SparseEmbeddings):
+        def embed_documents(self, texts):
+            return [SparseVector(indices=v.indices, values=v.values) for v in sparse_model.embed_documents(texts)]
+
+        def embed_query(self, text):
+            vector = sparse_model.embed_query(text)
+            return SparseVector(indices=vector.indices, values=vector.values)
+
+    if args.backend == "local":
+        return vs.get_collection(args.collection, DenseAdapter(), SparseAdapter())
+    return QdrantVectorStore(
+        client=client,
+        collection_name=args.collection,
+        embedding=DenseAdapter(),
+        sparse_embedding=SparseAdapter(),
+        retrieval_mode=RetrievalMode.HYBRID,
+        vector_name=config.dense_vector_name,
+        sparse_vector_name=config.sparse_vector_name
+    )
+
+def bench_queries(vs, collection, openai, queries, args):
+    import retrieval
+    import chatbot
+    import reranker
+
+    timings = {"search": [], "fetch": [], "rerank": [], "filter": [], "respond": [], "end_to_end": []}
+    cases = []
+    for query in queries:
+        vs.point_cache.invalidate()
+        start = time.perf_counter()
+        retriever = retrieval.Retriever(query, collection)
+        retriever.similarity_search(args.k)
+        searched = time.perf_counter()
+        retriever.fetch_points()
+        fetched = time.perf_counter()
+        retriever.rerank(["policy", "effect"])
+        reranked = time.perf_counter()
+        retriever.cos_filtering(["policy", "effect"], 0.8, args.filter_k)
+        filtered = time.perf_counter()
+        chatbot.respond(query, " ".join(retriever.filtered_contents), client=openai)
+        responded = time.perf_counter()
+
+        timings["search"].append(searched - start)
+        timings["fetch"].append(fetched - searched)
+        timings["rerank"].append(reranked - fetched)
+        timings["filter"].append(filtered - reranked)
+        timings["respond"].append(responded - filtered)
+        timings["end_to_end"].append(responded - start)
+        cases.append((query, list(retriever.found_docs), [retrieval.get_content(retriever.payload(doc), ["policy", "effect"]) for doc in retriever.found_docs]))
+    results = {stage: percentiles(samples) for stage, samples in timings.items()}
+    return results, reranker.pruning_report(cases, args.rerank_levels, min(10, args.k))
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"Comparison against {baseline_path}:")
+    old_rate = baseline["ingestion"]["items_per_second"]
+    new_rate = results["ingestion"]["items_per_second"]
+    print(f"  ingestion items/s: {old_rate:.1f} -> {new_rate:.1f} ({new_rate / old_rate:.2f}x)")
+    for stage, stats in results["queries"].items():
+        old = baseline["queries"].get(stage, {}).get("p95_ms")
+        if old:
+            print(f"  {stage} p95: {old:.2f}ms -> {stats['p95_ms']:.2f}ms ({stats['p95_ms'] / old:.2f}x)")
+
+def bench_imports(modules=None, repeats=3, budget=None):
+    # Each module is imported in a fresh interpreter, so results are true cold starts.
+    code = (
+        "import sys, time, json; start = time.perf_counter(); import {module}; "
+        "print(json.dumps([time.perf_counter() - start, [m for m in {heavy} if m in sys.modules]]))"
+    )
+    results = {}
+    failed = False
+    for module in modules or IMPORT_MODULES:
+        samples = []
+        for _ in range(repeats):
+            output = subprocess.run(
+                [sys.executable, "-c", code.format(module=module, heavy=HEAVY_MODULES)],
+                capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            seconds, heavy = json.loads(output.stdout.strip().splitlines()[-1])
+            samples.append(seconds)
+        results[module] = {"seconds": min(samples), "heavy_modules": heavy}
+        over_budget = budget is not None and min(samples) > budget
+        failed = failed or over_budget or bool(heavy)
+        print(f"import {module}: {min(samples) * 1000:.0f}ms{' (over budget)' if over_budget else ''}{', loaded ' + ', '.join(heavy) if heavy else ''}")
+    return results, failed
+
+CLIENT_CHECK = """
+import asyncio, tempfile, clients
+async def build():
+    clients.async_openai()
+    await clients.get("async_http")._transport.pool().aclose()
+clients.openai(); clients.raw("openai"); clients.get("limited_http"); clients.chat_model()
+asyncio.run(build()); asyncio.run(build())
+clients.create_qdrant("local", tempfile.mkdtemp())
+print("ok")
+"""
+
+def check_clients(timeout=60):
+    # Builds the real client factories (no fakes, no requests) in a fresh interpreter, so a deadlock shows up as a timeout.
+    try:
+        output = subprocess.run(
+            [sys.executable, "-c", CLIENT_CHECK],
+            capture_output=True, text=True, timeout=timeout, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+    except subprocess.TimeoutExpired:
+        print(f"Building the clients did not finish within {timeout}s.")
+        return False
+    if output.returncode != 0:
+        print(output.stderr.strip().splitlines()[-1] if output.stderr.strip() else "Building the clients failed.")
+        return False
+    print("All client factories built.")
+    return True
+
+def _count_chunks(text_path, chunk_size, overlap):
+    import chunker
+    return sum(1 for _ in chunker.chunk_file(text_path, chunk_size, overlap))
+
+def bench_chunking(text_folder, chunk_size=None, overlap=None, workers=None):
+    # Compares llama_index's SentenceSplitter over whole documents with the streaming chunker.
+    import tracemalloc
+    from concurrent.futures import ProcessPoolExecutor
+    from llama_index.core.node_parser import SentenceSplitter
+    chunk_size = chunk_size or config.chunk_size
+    overlap = config.overlap if overlap is None else overlap
+    text_paths = sorted(
+        os.path.join(root, name) for root, _, files in os.walk(text_folder) for name in files if name.endswith(".txt")
+    )
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
+
+    def sentence_splitter():
+        total = 0
+        for text_path in text_paths:
+            with open(text_path, "r", encoding="utf-8") as f:
+                total += len(splitter.split_text(f.read()))
+        return total
+
+    def stream_chunker():
+        return sum(_count_chunks(text_path, chunk_size, overlap) for text_path in text_paths)
+
+    def stream_chunker_parallel():
+        with ProcessPoolExecutor(max_workers=workers or config.chunking_workers) as pool:
+            return sum(pool.map(_count_chunks, text_paths, [chunk_size] * len(text_paths), [overlap] * len(text_paths)))
+
+    megabytes = sum(os.path.getsize(text_path) for text_path in text_paths) / 1e6
+    results = {"files": len(text_paths), "megabytes": megabytes}
+    for name, fn in [("sentence_splitter", sentence_splitter), ("stream_chunker", stream_chunker), ("stream_chunker_parallel", stream_chunker_parallel)]:
+        start = time.perf_counter()
+        chunks = fn()
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": elapsed, "chunks": chunks, "megabytes_per_second": megabytes / elapsed if elapsed else 0.0}
+        memory_text = ""
+        # tracemalloc only sees this process, so the worker pool's memory is not reported.
+        if name != "stream_chunker_parallel":
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[name]["peak_memory_mb"] = peak / 1e6
+            memory_text = f", peak {peak / 1e6:.1f} MB"
+        print(f"{name}: {chunks} chunks in {elapsed:.2f}s ({results[name]['megabytes_per_second']:.2f} MB/s{memory_text})")
+    return results
+
+def run(args):
+    if args.metrics:
+        inst.enable()
+    vs, client, openai, sparse_model = setup(args)
+    policies = synthetic_policies(args.corpus_size, args.seed)
+    queries = synthetic_queries(args.queries, args.seed + 1)
+
+    results = {"settings": vars(args), "ingestion": bench_ingestion(vs, client, openai, sparse_model, policies, args)}
+    collection = get_collection(vs, client, openai, sparse_model, args)
+    results["queries"], results["rerank_pruning"] = bench_queries(vs, collection, openai, queries, args)
+    results["api_calls"] = dict(openai.calls)
+    if args.metrics:
+        results["metrics"] = inst.metrics.snapshot()
+        inst.metrics.report()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    print(json.dumps({key: results[key] for key in ("ingestion", "queries")}, indent=4))
+    print(f"Results saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingestion and query latency benchmark.")
+    parser.add_argument("--corpus-size", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=30)
+    parser.add_argument("--filter-k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--backend", choices=["memory", "local"], default="memory")
+    parser.add_argument("--local-path", default=".bench_index")
+    parser.add_argument("--collection", default="Benchmark")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Simulated seconds per OpenAI request.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Simulated seconds per streamed token.")
+    parser.add_argument("--rerank-latency", type=float, default=0.0, help="Simulated seconds per cross-encoder pair.")
+    parser.add_argument("--rerank-levels", type=lambda text: [float(level) if "." in level else int(level) for level in text.split(",")],
+                        default=[5, 10, 20], help="Candidate counts (or fractions) kept before reranking, e.g. 5,10,0.5.")
+    parser.add_argument("--metrics", action="store_true", help="Collect per-stage instrumentation into the results.")
+    parser.add_argument("--imports", action="store_true", help="Only measure cold import time of the pipeline modules.")
+    parser.add_argument("--import-budget", type=float, default=None, help="Fail when a module takes longer to import (seconds).")
+    parser.add_argument("--clients", action="store_true", help="Only check that the real client factories build (needs api.py, sends no requests).")
+    parser.add_argument("--chunking", default=None, metavar="TEXT_FOLDER", help="Only compare chunkers on the extracted .txt files in this folder.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against.")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.imports:
+        results, failed = bench_imports(budget=args.import_budget)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"imports": results}, f, indent=4)
+        sys.exit(1 if failed else 0)
+    if args.clients:
+        sys.exit(0 if check_clients() else 1)
+    if args.chunking:
+        results = bench_chunking(args.chunking)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"chunking": results}, f, indent=4)
+        sys.exit(0)
+    run(args)
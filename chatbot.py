@@ -1,10 +1,62 @@
-import api
-from openai import OpenAI
+import time
+import config
+import context_builder as cb
+import instrumentation as inst
+import clients
 
-def respond(query, context):
-    openai_client = OpenAI(api_key=api.OPENAI_API)
+class StreamStats:
+    def __init__(self):
+        self.start = None
+        self.first_token_at = None
+        self.end = None
+        self.chunks = 0
 
-    messages = [
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.start
+
+    @property
+    def total_latency(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def _started(self):
+        self.start = time.perf_counter()
+
+    def _received(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks += 1
+
+    def _finished(self):
+        self.end = time.perf_counter()
+
+def fit_contexts(sources, budget):
+    # Sources are lists of scored Passages; plain context strings are treated as one passage and truncated.
+    passages = {name: value if isinstance(value, list) else [cb.Passage(value, 1.0)] for name, value in sources.items()}
+    contexts, report = cb.build_context(passages, budget)
+    print(f"Context uses {report['total_tokens']} of {report['budget']} tokens: {report['tokens']}")
+    return contexts
+
+def join_context(value):
+    # Unbounded contexts are sent as they are; passage lists are joined like pack() joins them.
+    return "\n\n".join(passage.text for passage in value) if isinstance(value, list) else value
+
+def _context_budget(max_context_tokens):
+    # None means the configured budget, 0 sends the context unbounded.
+    return config.context_token_budget if max_context_tokens is None else max_context_tokens
+
+def respond_messages(query, context, max_context_tokens=None):
+    max_context_tokens = _context_budget(max_context_tokens)
+    if max_context_tokens:
+        context = fit_contexts({"policies": context}, max_context_tokens)["policies"]
+    else:
+        context = join_context(context)
+
+    return [
         {
             "role": "system",
             "content": (
@@ -23,18 +75,15 @@ def respond(query, context):
         }
     ]
 
-    response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        max_tokens=1000,
-    )
-
-    return response.choices[0].message.content
-
-def answer_with_knowledge(query, context, knowledge):
-    openai_client = OpenAI(api_key=api.OPENAI_API)
+def knowledge_messages(query, context, knowledge, max_context_tokens=None):
+    max_context_tokens = _context_budget(max_context_tokens)
+    if max_context_tokens:
+        contexts = fit_contexts({"policies": context, "knowledge": knowledge}, max_context_tokens)
+        context, knowledge = contexts["policies"], contexts["knowledge"]
+    else:
+        context, knowledge = join_context(context), join_context(knowledge)
 
-    messages = [
+    return [
         {
             "role": "system",
             "content": (
@@ -55,10 +104,71 @@ def answer_with_knowledge(query, context, knowledge):
         }
     ]
 
+def _delta(chunk):
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+def _observe_stream(stats):
+    if inst.metrics.enabled:
+        inst.metrics.observe("chatbot.completion", stats.total_latency)
+        if stats.time_to_first_token is not None:
+            inst.metrics.observe("chatbot.time_to_first_token", stats.time_to_first_token)
+
+def stream_completion(messages, client=None, stats=None):
+    openai_client = client or clients.openai()
+    stats = stats if stats is not None else StreamStats()
+    stats._started()
     response = openai_client.chat.completions.create(
         model="gpt-4o-mini",
         messages=messages,
         max_tokens=1000,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    for chunk in response:
+        inst.record_usage("chatbot.completion", chunk)
+        text = _delta(chunk)
+        if text:
+            stats._received()
+            yield text
+    stats._finished()
+    _observe_stream(stats)
+
+async def astream_completion(messages, client=None, stats=None):
+    openai_client = client or clients.async_openai()
+    stats = stats if stats is not None else StreamStats()
+    stats._started()
+    response = await openai_client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        max_tokens=1000,
+        stream=True,
+        stream_options={"include_usage": True},
     )
+    async for chunk in response:
+        inst.record_usage("chatbot.completion", chunk)
+        text = _delta(chunk)
+        if text:
+            stats._received()
+            yield text
+    stats._finished()
+    _observe_stream(stats)
+
+def stream_respond(query, context, max_context_tokens=None, client=None, stats=None):
+    return stream_completion(respond_messages(query, context, max_context_tokens), client, stats)
+
+def stream_answer_with_knowledge(query, context, knowledge, max_context_tokens=None, client=None, stats=None):
+    return stream_completion(knowledge_messages(query, context, knowledge, max_context_tokens), client, stats)
+
+def astream_respond(query, context, max_context_tokens=None, client=None, stats=None):
+    return astream_completion(respond_messages(query, context, max_context_tokens), client, stats)
+
+def astream_answer_with_knowledge(query, context, knowledge, max_context_tokens=None, client=None, stats=None):
+    return astream_completion(knowledge_messages(query, context, knowledge, max_context_tokens), client, stats)
+
+def respond(query, context, max_context_tokens=None, client=None):
+    return "".join(stream_respond(query, context, max_context_tokens, client))
 
-    return response.choices[0].message.content
\ No newline at end of file
+def answer_with_knowledge(query, context, knowledge, max_context_tokens=None, client=None):
+    return "".join(stream_answer_with_knowledge(query, context, knowledge, max_context_tokens, client))
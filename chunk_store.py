@@ -0,0 +1,167 @@
+import os
+import json
+import mmap
+import numpy as np
+from tqdm import tqdm
+import util
+import pdf
+
+class ChunkStore:
+    """Append-only JSONL chunk corpus with an offset index for random access by id."""
+
+    def __init__(self, file_path, use_mmap=False):
+        self.file_path = file_path
+        self.index_path = f"{file_path}.index.json"
+        self.use_mmap = use_mmap
+        self.ids = []
+        self.positions = {}
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.batches = {}
+        self._mmap = None
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        if os.path.exists(file_path):
+            self._load_index()
+
+    def _load_index(self):
+        size = os.path.getsize(self.file_path)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("size") == size:
+                self._set_index(index["ids"], index["offsets"], index.get("batches", {}))
+                return
+        # Index missing or stale: rebuild it with one scan, keeping only the latest version of each source.
+        entries, batches = {}, {}
+        with open(self.file_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    source, batch = data["source"], data.get("batch")
+                    if source in batches and batches[source] != batch:
+                        del entries[source]
+                    batches[source] = batch
+                    entries.setdefault(source, []).append((data["id"], offset))
+                offset += len(line)
+        items = [item for source_items in entries.values() for item in source_items]
+        self._set_index([chunk_id for chunk_id, _ in items], [offset for _, offset in items], batches)
+        self.save_index()
+
+    def _set_index(self, ids, offsets, batches):
+        self.ids = list(ids)
+        self.positions = {chunk_id: position for position, chunk_id in enumerate(self.ids)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.batches = dict(batches)
+
+    def save_index(self):
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            json.dump({"size": os.path.getsize(self.file_path), "ids": self.ids, "offsets": self.offsets.tolist(), "batches": self.batches}, f)
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def add_many(self, chunks, source, replace=True):
+        # Ids are the deduplicator's "{source}#{i}" keys when chunks carry one, so provenance survives dropped duplicates.
+        # Storing a source again replaces its previous version; replace=False appends to it instead.
+        in_source = [position for position, chunk_id in enumerate(self.ids) if chunk_id.rsplit("#", 1)[0] == source]
+        start = 0 if replace else max((int(self.ids[position].rsplit("#", 1)[1]) + 1 for position in in_source), default=0)
+        self._close_mmap()
+        ids, offsets = [], []
+        with open(self.file_path, "ab") as f:
+            offset = f.tell()
+            batch = self.batches.get(source, offset) if not replace else offset
+            for i, chunk in enumerate(chunks, start):
+                data = chunk.to_dict() if isinstance(chunk, pdf.Chunk) else dict(chunk)
+                chunk_id = data.get("key") or f"{source}#{i}"
+                data["key"] = chunk_id
+                line = (json.dumps({"id": chunk_id, "source": source, "batch": batch, **data}, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                ids.append(chunk_id)
+                offsets.append(offset)
+                offset += len(line)
+        kept = np.ones(len(self.ids), dtype=bool)
+        if replace:
+            kept[in_source] = False
+        self.batches[source] = batch
+        self._set_index(
+            [chunk_id for chunk_id, keep in zip(self.ids, kept) if keep] + ids,
+            np.concatenate([self.offsets[kept], np.asarray(offsets, dtype=np.int64)]),
+            self.batches
+        )
+        self.save_index()
+        return ids
+
+    def add(self, chunk, source):
+        return self.add_many([chunk], source, replace=False)[0]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.positions
+
+    def _read_line(self, offset):
+        if self.use_mmap:
+            if self._mmap is None:
+                with open(self.file_path, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            end = self._mmap.find(b"\n", offset)
+            return self._mmap[offset:end if end != -1 else len(self._mmap)]
+        with open(self.file_path, "rb") as f:
+            f.seek(offset)
+            return f.readline()
+
+    def record(self, chunk_id):
+        return json.loads(self._read_line(int(self.offsets[self.positions[chunk_id]])))
+
+    def get(self, chunk_id):
+        return to_chunk(self.record(chunk_id))
+
+    def get_many(self, chunk_ids):
+        return [self.get(chunk_id) for chunk_id in chunk_ids]
+
+    def records(self, source=None):
+        # Streams live records in file order without holding the corpus in memory; replaced versions are skipped.
+        if not os.path.exists(self.file_path):
+            return
+        live = set(self.offsets.tolist())
+        with open(self.file_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if offset in live:
+                    data = json.loads(line)
+                    if source is None or data["source"] == source:
+                        yield data
+                offset += len(line)
+
+    def __iter__(self):
+        for data in self.records():
+            yield to_chunk(data)
+
+    def iter_source(self, source):
+        for data in self.records(source):
+            yield to_chunk(data)
+
+    def sources(self):
+        return list(dict.fromkeys(chunk_id.rsplit("#", 1)[0] for chunk_id in self.ids))
+
+    @classmethod
+    def from_folder(cls, folder, file_path, use_mmap=False):
+        # Converts a Chunks/ tree of indent-4 JSON lists into one store; sources are the relative paths.
+        store = cls(file_path, use_mmap)
+        existing = set(store.sources())
+        json_paths = []
+        for root, _, files in os.walk(folder):
+            json_paths.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(".json") and not name.endswith(".index.json"))
+        for json_path in tqdm(sorted(json_paths), desc=f"Converting {folder} to {file_path}"):
+            source = os.path.relpath(json_path, folder)[:-len(".json")].replace(os.sep, "/")
+            if source in existing:
+                continue
+            store.add_many(util.load_json(json_path) or [], source)
+        print(f"{len(store)} chunks from {len(store.sources())} files are stored in {file_path}")
+        return store
+
+def to_chunk(data):
+    return pdf.Chunk.from_dict({slot: data.get(slot) for slot in pdf.Chunk.__slots__})
@@ -0,0 +1,108 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import config
+import context_builder as cb
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+WORD = re.compile(r"\S+\s*")
+
+def sentences(f, block_size=1 << 16):
+    # Yields (text, start, end) per sentence from a text stream; text keeps its trailing whitespace.
+    buffer = ""
+    offset = 0
+    while True:
+        block = f.read(block_size)
+        buffer += block
+        start = 0
+        for match in SENTENCE_END.finditer(buffer):
+            if block and match.end() == len(buffer):
+                break
+            yield buffer[start:match.end()], offset + start, offset + match.start()
+            start = match.end()
+        if block and start == 0 and len(buffer) > 4 * block_size:
+            # No sentence end for a long stretch; cut at the last line or word break to bound memory.
+            cut = max(buffer.rfind("\n"), buffer.rfind(" ")) + 1 or len(buffer)
+            yield buffer[:cut], offset, offset + len(buffer[:cut].rstrip())
+            start = cut
+        buffer = buffer[start:]
+        offset += start
+        if not block:
+            if buffer.strip():
+                yield buffer, offset, offset + len(buffer.rstrip())
+            return
+
+def _split_long(text, start, chunk_size):
+    pieces = []
+    piece_start = 0
+    tokens = 0
+    for match in WORD.finditer(text):
+        word_tokens = cb.count_tokens(match.group())
+        if tokens and tokens + word_tokens > chunk_size:
+            piece = text[piece_start:match.start()]
+            pieces.append((piece, start + piece_start, start + piece_start + len(piece.rstrip()), tokens))
+            piece_start = match.start()
+            tokens = 0
+        tokens += word_tokens
+    piece = text[piece_start:]
+    pieces.append((piece, start + piece_start, start + piece_start + len(piece.rstrip()), tokens))
+    return pieces
+
+def _emit(window):
+    return "".join(item[0] for item in window).strip(), window[0][1], window[-1][2]
+
+def chunk_stream(units, chunk_size, overlap):
+    # Packs sentences into chunks of at most chunk_size tokens, repeating up to overlap tokens of trailing sentences.
+    window = []
+    tokens = 0
+    fresh = False
+    for text, start, end in units:
+        n = cb.count_tokens(text)
+        pieces = _split_long(text, start, chunk_size) if n > chunk_size else [(text, start, end, n)]
+        for piece in pieces:
+            if window and tokens + piece[3] > chunk_size:
+                if fresh:
+                    yield _emit(window)
+                    fresh = False
+                kept = []
+                kept_tokens = 0
+                for item in reversed(window):
+                    if kept_tokens + item[3] > overlap:
+                        break
+                    kept.insert(0, item)
+                    kept_tokens += item[3]
+                while kept and kept_tokens + piece[3] > chunk_size:
+                    kept_tokens -= kept.pop(0)[3]
+                window = kept
+                tokens = kept_tokens
+            window.append(piece)
+            tokens += piece[3]
+            fresh = True
+    if window and fresh:
+        yield _emit(window)
+
+def chunk_file(text_path, chunk_size=None, overlap=None):
+    chunk_size = chunk_size or config.chunk_size
+    overlap = config.overlap if overlap is None else overlap
+    with open(text_path, "r", encoding="utf-8", newline="") as f:
+        yield from chunk_stream(sentences(f), chunk_size, overlap)
+
+def _chunk_pdf(pdf_path, text_folder, chunk_size, overlap):
+    import pdf
+    return [chunk.to_dict() for chunk in pdf.PDF(pdf_path).stream_chunks(text_folder, chunk_size, overlap)]
+
+def chunk_many(pdf_paths, text_folder, chunk_size=None, overlap=None, workers=None, store=None):
+    # Chunks the extracted texts of many PDFs in a process pool; results keep the input order.
+    import pdf
+    chunk_size = chunk_size or config.chunk_size
+    overlap = config.overlap if overlap is None else overlap
+    workers = workers or config.chunking_workers
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunked = pool.map(_chunk_pdf, pdf_paths, [text_folder] * len(pdf_paths), [chunk_size] * len(pdf_paths), [overlap] * len(pdf_paths))
+        for pdf_path, chunks in tqdm(zip(pdf_paths, chunked), total=len(pdf_paths), desc="Chunking extracted texts"):
+            results[pdf_path] = [pdf.Chunk.from_dict(chunk) for chunk in chunks]
+            if store is not None:
+                store.add_many(results[pdf_path], pdf.PDF(pdf_path).chunk_source())
+    print(f"Chunked {len(pdf_paths)} PDFs into {sum(len(chunks) for chunks in results.values())} chunks")
+    return results
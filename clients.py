@@ -0,0 +1,221 @@
+import asyncio
+import weakref
+import threading
+from contextlib import nullcontext
+import config
+import llm_executor
+
+# Clients are built on first use so importing a module needs neither the SDKs nor credentials.
+# Reentrant because factories get() the http clients they are built on.
+_lock = threading.RLock()
+_instances = {}
+
+class EndpointLimits:
+    """Per-endpoint semaphores; "qdrant" covers every qdrant.* call unless a longer prefix is configured."""
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or config.client_concurrency
+        self.semaphores = {}
+        self._lock = threading.Lock()
+
+    def semaphore(self, endpoint):
+        parts = endpoint.split(".")
+        for size in range(len(parts), 0, -1):
+            prefix = ".".join(parts[:size])
+            if prefix in self.concurrency:
+                with self._lock:
+                    if prefix not in self.semaphores:
+                        self.semaphores[prefix] = threading.BoundedSemaphore(self.concurrency[prefix])
+                    return self.semaphores[prefix]
+        return nullcontext()
+
+    async def acquire_async(self, endpoint):
+        # Polls so the event loop is never blocked and a cancelled caller never ends up holding a slot.
+        semaphore = self.semaphore(endpoint)
+        if isinstance(semaphore, nullcontext):
+            return None
+        while not semaphore.acquire(blocking=False):
+            await asyncio.sleep(0.005)
+        return semaphore
+
+limits = EndpointLimits()
+
+class Managed:
+    """Wraps an SDK client so every method call holds its endpoint's semaphore and retries transient errors."""
+
+    def __init__(self, target, endpoint, endpoint_limits=None):
+        self._target = target
+        self._endpoint = endpoint
+        self._limits = endpoint_limits or limits
+
+    @property
+    def raw(self):
+        return self._target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        endpoint = f"{self._endpoint}.{name}"
+        if callable(attr):
+            semaphore = self._limits.semaphore(endpoint)
+            def call(*args, **kwargs):
+                with semaphore:
+                    return llm_executor.call_with_retry(lambda: attr(*args, **kwargs), config.client_max_retries)
+            return call
+        if attr is None or isinstance(attr, (str, bytes, int, float, bool, dict, list, tuple)):
+            return attr
+        return Managed(attr, endpoint, self._limits)
+
+def _endpoint(service, request):
+    # "/v1/chat/completions" -> "openai.chat.completions", matching the names Managed uses.
+    parts = [part for part in request.url.path.split("/") if part and part != "v1"]
+    return ".".join([service] + parts)
+
+def _limited_transport(service, endpoint_limits=None):
+    # For SDK clients that are not wrapped in Managed (AsyncOpenAI, ChatOpenAI), limits are applied per HTTP request.
+    import httpx
+    endpoint_limits = endpoint_limits or limits
+
+    class LimitedTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            with endpoint_limits.semaphore(_endpoint(service, request)):
+                return super().handle_request(request)
+
+    return LimitedTransport(limits=httpx.Limits(max_connections=config.http_max_connections, max_keepalive_connections=config.http_max_keepalive))
+
+def _limited_async_transport(service, endpoint_limits=None):
+    import httpx
+    endpoint_limits = endpoint_limits or limits
+
+    class LimitedAsyncTransport(httpx.AsyncBaseTransport):
+        # Pooled connections belong to the event loop that opened them, so each loop gets its own pool.
+        # That keeps one AsyncClient usable across asyncio.run calls.
+
+        def __init__(self):
+            self.pools = weakref.WeakKeyDictionary()
+            self._lock = threading.Lock()
+
+        def pool(self):
+            loop = asyncio.get_running_loop()
+            with self._lock:
+                pool = self.pools.get(loop)
+                if pool is None:
+                    pool = self.pools[loop] = httpx.AsyncHTTPTransport(
+                        limits=httpx.Limits(max_connections=config.http_max_connections, max_keepalive_connections=config.http_max_keepalive)
+                    )
+                return pool
+
+        async def handle_async_request(self, request):
+            semaphore = await endpoint_limits.acquire_async(_endpoint(service, request))
+            try:
+                return await self.pool().handle_async_request(request)
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+
+        async def aclose(self):
+            with self._lock:
+                pool = self.pools.pop(asyncio.get_running_loop(), None)
+            if pool is not None:
+                await pool.aclose()
+
+    return LimitedAsyncTransport()
+
+def _http():
+    import httpx
+    return httpx.Client(
+        timeout=config.client_timeout,
+        limits=httpx.Limits(max_connections=config.http_max_connections, max_keepalive_connections=config.http_max_keepalive)
+    )
+
+def _limited_http():
+    import httpx
+    return httpx.Client(timeout=config.client_timeout, transport=_limited_transport("openai"))
+
+def _async_http():
+    import httpx
+    return httpx.AsyncClient(timeout=config.client_timeout, transport=_limited_async_transport("openai"))
+
+def _openai():
+    import api
+    from openai import OpenAI
+    # Retries are done by Managed so they share one backoff policy with Qdrant.
+    client = OpenAI(api_key=api.OPENAI_API, timeout=config.client_timeout, max_retries=0, http_client=get("http"))
+    return Managed(client, "openai")
+
+def _async_openai():
+    import api
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=api.OPENAI_API, timeout=config.client_timeout, max_retries=config.client_max_retries, http_client=get("async_http"))
+
+def create_qdrant(backend=None, path=None):
+    backend = backend or config.vector_backend
+    if backend == "local":
+        import local_index
+        return local_index.LocalClient(path)
+    import api
+    from qdrant_client import QdrantClient
+    client = QdrantClient(url=api.QDRANT_URL, api_key=api.QDRANT_API, timeout=int(config.client_timeout), pool_size=config.http_max_connections)
+    return Managed(client, "qdrant")
+
+def chat_model(temperature=0.7, model=None):
+    import api
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=model or config.llm_model,
+        temperature=temperature,
+        api_key=api.OPENAI_API,
+        timeout=config.client_timeout,
+        max_retries=config.client_max_retries,
+        http_client=get("limited_http"),
+        http_async_client=get("async_http")
+    )
+
+factories = {
+    "http": _http,
+    "limited_http": _limited_http,
+    "async_http": _async_http,
+    "openai": _openai,
+    "async_openai": _async_openai,
+    "qdrant": create_qdrant,
+}
+
+def get(name):
+    client = _instances.get(name)
+    if client is None:
+        with _lock:
+            client = _instances.get(name)
+            if client is None:
+                client = _instances[name] = factories[name]()
+    return client
+
+def set_client(name, client):
+    with _lock:
+        _instances[name] = client
+
+def reset(name=None):
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+def raw(name):
+    # For callers that already limit concurrency and retry themselves, e.g. LLMExecutor.
+    client = get(name)
+    return client.raw if isinstance(client, Managed) else client
+
+def use_fakes(openai_client=None, qdrant_client=None):
+    # Offline mode: fakes go through the same Managed layer, so retries and limits are exercised too.
+    import fakes
+    from qdrant_client import QdrantClient
+    set_client("openai", Managed(openai_client or fakes.FakeOpenAI(), "openai"))
+    set_client("qdrant", Managed(qdrant_client or QdrantClient(":memory:"), "qdrant"))
+
+def openai():
+    return get("openai")
+
+def async_openai():
+    return get("async_openai")
+
+def qdrant():
+    return get("qdrant")
@@ -5,4 +5,85 @@ chunks_folder = 'Chunks'
 collection_name = 'Datathon'
 
 chunk_size = 1000
-overlap = 100
\ No newline at end of file
+overlap = 100
+chunking_workers = 4
+
+dense_model = 'text-embedding-3-small'
+sparse_model = 'prithivida/Splade_PP_en_v1'
+
+ingest_batch_size = 256
+embed_batch_size = 64
+upload_batch_size = 64
+upload_workers = 1
+
+cross_encoder_model = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+model_idle_seconds = 1800
+max_loaded_models = 4
+
+embedding_cache_enabled = True
+embedding_cache_path = '.cache/embeddings.sqlite'
+embedding_cache_memory_items = 10000
+embedding_cache_max_rows = 2000000
+
+point_cache_size = 4096
+
+llm_model = 'gpt-4o-mini'
+llm_concurrency = 8
+llm_requests_per_minute = 500
+llm_tokens_per_minute = 200000
+llm_max_retries = 5
+llm_retry_base_delay = 1.0
+llm_retry_max_delay = 60.0
+
+relevance_pack_size = 8
+
+extraction_workers = 4
+extraction_pages_per_task = 200
+
+manifest_path = 'manifest.json'
+
+dedup_threshold = 0.85
+dedup_num_perm = 128
+dedup_shingle_size = 5
+
+payload_indexes = {'country': 'keyword', 'year_number': 'integer'}
+
+agent_concurrency = 8
+
+tokenizer_encoding = 'o200k_base'
+context_token_budget = 6000
+context_weights = {'policies': 0.6, 'knowledge': 0.4}
+
+semantic_cache_threshold = 0.95
+semantic_cache_ttl = 86400
+semantic_cache_max_entries = 1000
+
+vector_backend = 'qdrant'
+local_index_path = '.local_index'
+local_index_dtype = 'float32'
+local_exact_search = True
+local_ivf_lists = 256
+local_ivf_probes = 8
+local_ivf_min_points = 20000
+local_block_rows = 8192
+local_max_segments = 8
+
+instrumentation_enabled = False
+chunk_store_path = 'chunks.jsonl'
+
+client_timeout = 60.0
+client_max_retries = 3
+http_max_connections = 100
+http_max_keepalive = 20
+client_concurrency = {'openai.chat': 16, 'openai.embeddings': 8, 'qdrant': 32}
+
+rerank_backend = 'torch'
+cross_encoder_onnx_file = 'onnx/model_qint8_avx512.onnx'
+rerank_batch_size = 64
+rerank_max_wait = 0.005
+rerank_cache_size = 50000
+rerank_keep = None
+
+dense_vector_name = 'dense'
+sparse_vector_name = 'sparse'
+hybrid_fusion = 'rrf'
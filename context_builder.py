@@ -0,0 +1,100 @@
+import re
+from collections import namedtuple
+import config
+
+Passage = namedtuple("Passage", ["text", "score", "id"], defaults=[0.0, None])
+
+_encoding = None
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(config.tokenizer_encoding)
+        except Exception:
+            _encoding = False
+    return _encoding
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+    else:
+        if len(text) <= max_tokens * 4:
+            return text
+        cut = text[:max_tokens * 4]
+    # Prefer ending on a sentence, then on a word, over cutting mid-word.
+    sentence_end = max(cut.rfind(". "), cut.rfind(".\n"), cut.rfind("\n"))
+    if sentence_end > len(cut) // 2:
+        return cut[:sentence_end + 1].rstrip()
+    word_end = cut.rfind(" ")
+    cut = (cut[:word_end] if word_end > 0 else cut).rstrip()
+    # The marker can push the text over the budget; drop words until it fits.
+    while cut and count_tokens(cut + " ...") > max_tokens:
+        word_end = cut.rfind(" ")
+        cut = (cut[:word_end] if word_end > 0 else cut[:-1]).rstrip()
+    return cut + " ..." if cut else ""
+
+def _normalized(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def pack(passages, budget, min_tokens=50, separator="\n\n"):
+    # Highest score first, duplicates skipped, the first passage that does not fit is truncated.
+    separator_tokens = count_tokens(separator)
+    selected = []
+    used = 0
+    seen = set()
+    for passage in sorted(passages, key=lambda passage: passage.score, reverse=True):
+        keys = {("text", _normalized(passage.text)), ("id", passage.id)} if passage.id is not None else {("text", _normalized(passage.text))}
+        if not passage.text or keys & seen:
+            continue
+        seen |= keys
+        remaining = budget - used - (separator_tokens if selected else 0)
+        tokens = count_tokens(passage.text)
+        if tokens <= remaining:
+            selected.append(passage.text)
+            used += tokens + (separator_tokens if len(selected) > 1 else 0)
+        elif remaining >= min_tokens:
+            text = truncate_to_tokens(passage.text, remaining)
+            selected.append(text)
+            used += count_tokens(text) + (separator_tokens if len(selected) > 1 else 0)
+            break
+        else:
+            break
+    return separator.join(selected), used
+
+def build_context(sources, budget=None, weights=None):
+    # sources: name -> list of Passage. Unused budget of one source is handed to the others.
+    budget = budget or config.context_token_budget
+    weights = weights or config.context_weights
+    names = list(sources)
+    total_weight = sum(weights.get(name, 1.0) for name in names) or 1.0
+    allocation = {name: int(budget * weights.get(name, 1.0) / total_weight) for name in names}
+
+    contexts = {}
+    used = {}
+    for name in names:
+        contexts[name], used[name] = pack(sources[name], allocation[name])
+    spare = budget - sum(used.values())
+    for name in names:
+        if spare <= 0:
+            break
+        if used[name] >= allocation[name] - 50:
+            contexts[name], new_used = pack(sources[name], used[name] + spare)
+            spare -= new_used - used[name]
+            used[name] = new_used
+
+    report = {"budget": budget, "tokens": dict(used), "total_tokens": sum(used.values())}
+    return contexts, report
@@ -0,0 +1,79 @@
+import re
+import json
+import hashlib
+import numpy as np
+import config
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def shingles(text, size):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def hash_shingles(items):
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=4).digest(), "little") for item in items],
+        dtype=np.uint64
+    )
+
+def lsh_parameters(threshold, num_perm):
+    # Band/row split whose S-curve midpoint (1/b)^(1/r) is closest to the threshold.
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+class ChunkDeduplicator:
+    def __init__(self, threshold=None, num_perm=None, shingle_size=None, seed=1):
+        self.threshold = threshold or config.dedup_threshold
+        self.num_perm = num_perm or config.dedup_num_perm
+        self.shingle_size = shingle_size or config.dedup_shingle_size
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, int(MERSENNE_PRIME), size=self.num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, int(MERSENNE_PRIME), size=self.num_perm, dtype=np.uint64)
+        self.bands, self.rows = lsh_parameters(self.threshold, self.num_perm)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}
+        self.mapping = {}
+        self.checked = 0
+
+    def signature(self, text):
+        hashes = hash_shingles(shingles(text, self.shingle_size))
+        permuted = np.bitwise_and((np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME, MAX_HASH)
+        return permuted.min(axis=0)
+
+    def add(self, key, text):
+        # Returns the canonical key if text is a near-duplicate of an earlier one, otherwise None.
+        self.checked += 1
+        signature = self.signature(text)
+        band_keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+        candidates = dict.fromkeys(
+            candidate
+            for band, band_key in enumerate(band_keys)
+            for candidate in self.buckets[band].get(band_key, [])
+        )
+        for candidate in candidates:
+            if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                self.mapping[key] = candidate
+                return candidate
+
+        self.signatures[key] = signature
+        for band, band_key in enumerate(band_keys):
+            self.buckets[band].setdefault(band_key, []).append(key)
+        return None
+
+    def stats(self, calls_per_chunk=3):
+        dropped = len(self.mapping)
+        return {
+            "checked": self.checked,
+            "kept": self.checked - dropped,
+            "dropped": dropped,
+            "api_calls_saved": dropped * calls_per_chunk,
+        }
+
+    def save_mapping(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.mapping, f, ensure_ascii=False, indent=4)
+        print(f"Duplicate mapping written to {path}")
@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+import config
+
+SparseEmbedding = namedtuple("SparseEmbedding", ["indices", "values"])
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def encode(embedding):
+    if hasattr(embedding, "indices"):
+        indices = array("i", [int(i) for i in embedding.indices])
+        values = array("f", [float(v) for v in embedding.values])
+        return b"s" + len(indices).to_bytes(4, "little") + indices.tobytes() + values.tobytes()
+    return b"d" + array("f", [float(v) for v in embedding]).tobytes()
+
+def decode(blob):
+    if blob[:1] == b"s":
+        size = int.from_bytes(blob[1:5], "little")
+        indices = array("i")
+        indices.frombytes(blob[5:5 + 4 * size])
+        values = array("f")
+        values.frombytes(blob[5 + 4 * size:])
+        return SparseEmbedding(indices.tolist(), values.tolist())
+    values = array("f")
+    values.frombytes(blob[1:])
+    return values.tolist()
+
+class EmbeddingCache:
+    def __init__(self, path=None, memory_items=None, max_rows=None):
+        self.path = path or config.embedding_cache_path
+        self.memory_items = memory_items if memory_items is not None else config.embedding_cache_memory_items
+        self.max_rows = max_rows if max_rows is not None else config.embedding_cache_max_rows
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT, key TEXT, value BLOB, last_used REAL, PRIMARY KEY (model, key))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.connection.commit()
+        # Counted once here and kept up to date on writes, so eviction never scans the table.
+        self.rows = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _remember(self, memory_key, value):
+        self.memory[memory_key] = value
+        self.memory.move_to_end(memory_key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get_many(self, model, texts):
+        keys = [text_key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self.memory.get((model, key))
+                if value is not None:
+                    self.memory.move_to_end((model, key))
+                    self.hits += 1
+                    results[i] = value
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                found = {}
+                key_list = list(missing)
+                for start in range(0, len(key_list), 500):
+                    part = key_list[start:start + 500]
+                    rows = self.connection.execute(
+                        f"SELECT key, value FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(part))})",
+                        [model, *part]
+                    ).fetchall()
+                    found.update(rows)
+                if found:
+                    now = time.time()
+                    self.connection.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?",
+                        [(now, model, key) for key in found]
+                    )
+                    self.connection.commit()
+                for key, positions in missing.items():
+                    if key in found:
+                        value = decode(found[key])
+                        self._remember((model, key), value)
+                        self.disk_hits += len(positions)
+                        for i in positions:
+                            results[i] = value
+                    else:
+                        self.misses += len(positions)
+        return results
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model, texts, embeddings):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = text_key(text)
+                blob = encode(embedding)
+                value = decode(blob)
+                self._remember((model, key), value)
+                rows.append((model, key, blob, now))
+            # Update first, then insert what is left, so the insert's rowcount is exactly the number of new rows.
+            self.connection.executemany(
+                "UPDATE embeddings SET value = ?, last_used = ? WHERE model = ? AND key = ?",
+                [(blob, now, model, key) for model, key, blob, now in rows]
+            )
+            self.rows += self.connection.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows).rowcount
+            self.connection.commit()
+            self._evict()
+
+    def put(self, model, text, embedding):
+        self.put_many(model, [text], [embedding])
+
+    def _evict(self):
+        if self.rows > self.max_rows:
+            deleted = self.connection.execute(
+                "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (self.rows - self.max_rows,)
+            ).rowcount
+            self.connection.commit()
+            self.rows -= deleted
+
+    def cached(self, model, texts, compute):
+        # Look texts up, compute only the misses (deduplicated) and store them.
+        results = self.get_many(model, texts)
+        missing = list(dict.fromkeys(text for text, value in zip(texts, results) if value is None))
+        if missing:
+            computed = dict(zip(missing, compute(missing)))
+            self.put_many(model, missing, [computed[text] for text in missing])
+            results = [value if value is not None else computed[text] for text, value in zip(texts, results)]
+        return results
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_items": len(self.memory),
+            }
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def default_cache():
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
@@ -0,0 +1,80 @@
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import fitz
+from tqdm import tqdm
+import config
+import pdf
+
+def _extract_part(pdf_path, part_path, start_page, end_page):
+    doc = fitz.open(pdf_path)
+    with open(part_path, "w", encoding="utf-8") as f:
+        pages = pdf.write_pages(doc, f, start_page, end_page)
+    doc.close()
+    return pages
+
+def plan_tasks(pdf_paths, output_folder, pages_per_task):
+    tasks = {}
+    for pdf_path in pdf_paths:
+        file = pdf.PDF(pdf_path)
+        with fitz.open(pdf_path) as doc:
+            page_count = len(doc)
+        text_path = file.text_path(output_folder)
+        tasks[pdf_path] = [
+            (pdf_path, f"{text_path}.part{i}", start, min(start + pages_per_task, page_count))
+            for i, start in enumerate(range(0, page_count, pages_per_task))
+        ]
+    return tasks
+
+def _merge_parts(file, output_folder, parts, part_pages):
+    pages = []
+    offset = 0
+    with open(file.text_path(output_folder), "w", encoding="utf-8") as out:
+        for part, part_offsets in zip(parts, part_pages):
+            part_path = part[1]
+            with open(part_path, "r", encoding="utf-8") as f:
+                shutil.copyfileobj(f, out)
+            os.remove(part_path)
+            pages.extend({"page": page["page"], "start": page["start"] + offset, "end": page["end"] + offset} for page in part_offsets)
+            offset = pages[-1]["end"] if pages else offset
+    pdf.save_page_offsets(file.pdf_path, pages, file.pages_path(output_folder))
+    return pages
+
+def extract_many(pdf_paths, output_folder, workers=None, pages_per_task=None, manifest=None):
+    # Splits every PDF into page ranges, extracts the ranges in a process pool and stitches them in order.
+    if manifest is not None:
+        for removed_path in manifest.removed_files(pdf_paths):
+            removed = pdf.PDF(removed_path)
+            for path in (removed.text_path(output_folder), removed.pages_path(output_folder)):
+                if os.path.exists(path):
+                    os.remove(path)
+            manifest.remove(f"file:{removed_path}")
+        skipped = len(pdf_paths)
+        pdf_paths = manifest.pending_files(pdf_paths, "extracted")
+        print(f"{skipped - len(pdf_paths)} PDFs are unchanged since the last extraction.")
+    workers = workers or config.extraction_workers
+    pages_per_task = pages_per_task or config.extraction_pages_per_task
+    for pdf_path in pdf_paths:
+        os.makedirs(f"{output_folder}/{pdf.PDF(pdf_path).folder_name}", exist_ok=True)
+
+    tasks = plan_tasks(pdf_paths, output_folder, pages_per_task)
+    results = {pdf_path: [None] * len(parts) for pdf_path, parts in tasks.items()}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_extract_part, *part): (pdf_path, i)
+            for pdf_path, parts in tasks.items()
+            for i, part in enumerate(parts)
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Extracting page ranges"):
+            pdf_path, i = futures[future]
+            results[pdf_path][i] = future.result()
+
+    page_offsets = {}
+    for pdf_path, parts in tasks.items():
+        page_offsets[pdf_path] = _merge_parts(pdf.PDF(pdf_path), output_folder, parts, results[pdf_path])
+        if manifest is not None:
+            manifest.mark_file(pdf_path, "extracted")
+    if manifest is not None:
+        manifest.save()
+    print(f"Extracted {len(pdf_paths)} PDFs into {output_folder}")
+    return page_offsets
@@ -0,0 +1,147 @@
+import hashlib
+import re
+import time
+from types import SimpleNamespace
+
+def _usage(prompt, completion):
+    prompt_tokens = max(1, len(prompt) // 4)
+    completion_tokens = max(1, len(completion) // 4)
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens
+    )
+
+def default_reply(messages, max_tokens=None):
+    prompt = messages[-1]["content"]
+    if "JSON list of" in prompt:
+        return str([1] * len(re.findall(r"Segment \d+:", prompt)))
+    if "answer with exactly one number" in prompt:
+        return "1"
+    if "Policy:" in prompt and "Year:" in prompt:
+        return "Policy: Carbon tax\nEffect: Lower emissions\nCountry: Canada\nYear: 2019"
+    return "- " + prompt.strip().split("\n")[-1][:200]
+
+class FakeError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Fake API error {status_code}")
+        self.status_code = status_code
+
+class _Completions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, messages, max_tokens=None, stream=False, **kwargs):
+        self.owner._before_call("chat")
+        content = self.owner.reply(messages, max_tokens)
+        prompt = "".join(message["content"] for message in messages)
+        if stream:
+            return self._stream(content, _usage(prompt, content) if (kwargs.get("stream_options") or {}).get("include_usage") else None)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=SimpleNamespace(role="assistant", content=content), finish_reason="stop")],
+            usage=_usage(prompt, content)
+        )
+
+    def _stream(self, content, usage=None):
+        for word in re.findall(r"\S+\s*", content):
+            if self.owner.token_latency:
+                time.sleep(self.owner.token_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=word))], usage=None)
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+class _Embeddings:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, input, model, **kwargs):
+        self.owner._before_call("embeddings")
+        texts = [input] if isinstance(input, str) else list(input)
+        data = [SimpleNamespace(index=i, embedding=fake_embedding(text, self.owner.dim)) for i, text in enumerate(texts)]
+        return SimpleNamespace(model=model, data=data, usage=_usage("".join(texts), ""))
+
+def fake_embedding(text, dim):
+    # Deterministic unit-scale vector derived from the text hash.
+    values = []
+    seed = text.encode("utf-8")
+    while len(values) < dim:
+        seed = hashlib.sha256(seed).digest()
+        values.extend(byte / 127.5 - 1.0 for byte in seed)
+    return values[:dim]
+
+class FakeOpenAI:
+    """Offline stand-in for the parts of the OpenAI client used in this repo."""
+
+    def __init__(self, reply=None, latency=0.0, dim=1536, errors=None, token_latency=0.0):
+        self.reply = reply or default_reply
+        self.latency = latency
+        self.token_latency = token_latency
+        self.dim = dim
+        self.errors = list(errors or [])
+        self.calls = {"chat": 0, "embeddings": 0}
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.embeddings = _Embeddings(self)
+
+    def _before_call(self, endpoint):
+        self.calls[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.errors:
+            raise FakeError(self.errors.pop(0))
+
+class FakeSparseModel:
+    """Hashes words into a SPLADE-like sparse vector; stands in for SparseTextEmbedding and FastEmbedSparse."""
+
+    def __init__(self, vocabulary_size=30522):
+        self.vocabulary_size = vocabulary_size
+
+    def _vector(self, text):
+        weights = {}
+        for word in re.findall(r"\w+", text.lower()):
+            index = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "little") % self.vocabulary_size
+            weights[index] = weights.get(index, 0.0) + 1.0
+        indices = sorted(weights)
+        return SimpleNamespace(indices=indices, values=[weights[i] for i in indices])
+
+    def embed(self, texts, batch_size=None, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        for text in texts:
+            yield self._vector(text)
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+class FakeDenseEmbeddings:
+    """LangChain-style embedding function backed by a FakeOpenAI client."""
+
+    def __init__(self, client=None, model="text-embedding-3-small"):
+        self.client = client or FakeOpenAI()
+        self.model = model
+
+    def embed_documents(self, texts):
+        response = self.client.embeddings.create(input=texts, model=self.model)
+        return [item.embedding for item in response.data]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class FakeCrossEncoder:
+    """Scores pairs by word overlap instead of running a transformer."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def predict(self, pairs, **kwargs):
+        if self.latency:
+            time.sleep(self.latency * len(pairs))
+        scores = []
+        for query, document in pairs:
+            query_words = set(re.findall(r"\w+", query.lower()))
+            document_words = set(re.findall(r"\w+", document.lower()))
+            scores.append(len(query_words & document_words) / (len(query_words) or 1))
+        return scores
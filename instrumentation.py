@@ -0,0 +1,168 @@
+import time
+import json
+import bisect
+import functools
+import threading
+from contextlib import nullcontext
+import config
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_disabled = nullcontext()
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {str(le): n for le, n in zip(list(self.buckets) + ["+Inf"], self.counts)}
+        }
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.count(f"{self.name}.errors")
+        return False
+
+def _usage_counts(response):
+    # Handles OpenAI responses/stream chunks (.usage) and LangChain messages (.usage_metadata).
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    return 0, 0
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+            self.tokens = {}
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_usage(self, name, response=None, prompt_tokens=0, completion_tokens=0):
+        if not self.enabled:
+            return
+        if response is not None:
+            prompt_tokens, completion_tokens = _usage_counts(response)
+        if not prompt_tokens and not completion_tokens:
+            return
+        with self.lock:
+            tokens = self.tokens.setdefault(name, {"prompt": 0, "completion": 0})
+            tokens["prompt"] += prompt_tokens
+            tokens["completion"] += completion_tokens
+
+    def timer(self, name):
+        return _Timer(self, name) if self.enabled else _disabled
+
+    def timed(self, name=None):
+        def decorate(fn):
+            metric = name or fn.__qualname__
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Timer(self, metric):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timers": {name: histogram.to_dict() for name, histogram in sorted(self.timers.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "tokens": {name: dict(tokens) for name, tokens in sorted(self.tokens.items())}
+            }
+
+    def to_json(self, path=None):
+        text = json.dumps(self.snapshot(), indent=4)
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, prefix="pipeline"):
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+        for name, histogram in snapshot["timers"].items():
+            cumulative = 0
+            for le, n in histogram["buckets"].items():
+                cumulative += n
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {histogram["sum"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {histogram["count"]}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in snapshot["counters"].items():
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+        lines.append(f"# TYPE {prefix}_tokens_total counter")
+        for name, tokens in snapshot["tokens"].items():
+            for kind, value in tokens.items():
+                lines.append(f'{prefix}_tokens_total{{stage="{name}",kind="{kind}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        snapshot = self.snapshot()
+        for name, histogram in snapshot["timers"].items():
+            tokens = snapshot["tokens"].get(name)
+            token_text = f", {tokens['prompt']} prompt / {tokens['completion']} completion tokens" if tokens else ""
+            print(f"{name}: {histogram['count']} calls, {histogram['sum']:.2f}s total, {histogram['mean'] * 1000:.1f}ms mean{token_text}")
+        for name, value in snapshot["counters"].items():
+            print(f"{name}: {value}")
+
+metrics = Metrics(config.instrumentation_enabled)
+timer = metrics.timer
+timed = metrics.timed
+count = metrics.count
+record_usage = metrics.record_usage
+
+def enable():
+    metrics.enabled = True
+
+def disable():
+    metrics.enabled = False
@@ -0,0 +1,99 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+import config
+
+RETRYABLE_ERRORS = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError", "ResponseHandlingException"}
+
+def is_retryable(error):
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute or config.llm_requests_per_minute
+        self.tokens_per_minute = tokens_per_minute or config.llm_tokens_per_minute
+        self.request_budget = float(self.requests_per_minute)
+        self.token_budget = float(self.tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.request_budget = min(self.requests_per_minute, self.request_budget + elapsed * self.requests_per_minute / 60)
+        self.token_budget = min(self.tokens_per_minute, self.token_budget + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens=1):
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.request_budget >= 1 and self.token_budget >= tokens:
+                    self.request_budget -= 1
+                    self.token_budget -= tokens
+                    return
+                wait = max(
+                    (1 - self.request_budget) * 60 / self.requests_per_minute,
+                    (tokens - self.token_budget) * 60 / self.tokens_per_minute,
+                )
+            time.sleep(wait)
+
+def call_with_retry(fn, max_retries=None, base_delay=None, max_delay=None):
+    max_retries = config.llm_max_retries if max_retries is None else max_retries
+    base_delay = config.llm_retry_base_delay if base_delay is None else base_delay
+    max_delay = config.llm_retry_max_delay if max_delay is None else max_delay
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as error:
+            if attempt == max_retries or not is_retryable(error):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+
+class LLMExecutor:
+    def __init__(self, concurrency=None, requests_per_minute=None, tokens_per_minute=None, max_retries=None, client=None):
+        self.concurrency = concurrency or config.llm_concurrency
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.client = client
+
+    def map(self, fn, items, tokens=None, desc=None):
+        # Results come back in input order regardless of completion order.
+        items = list(items)
+        tokens = tokens or (lambda item: 1)
+
+        def run(item):
+            self.limiter.acquire(tokens(item))
+            return call_with_retry(lambda: fn(item), self.max_retries)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return list(tqdm(pool.map(run, items), total=len(items), desc=desc))
+
+    def run_chunks(self, chunks, operation, max_tokens=300, desc=None):
+        import clients
+        # The executor already rate limits and retries, so it skips the managed client's own layer.
+        client = self.client or clients.raw("openai")
+        return self.map(
+            lambda chunk: getattr(chunk, operation)(client=client),
+            chunks,
+            tokens=lambda chunk: estimate_tokens(chunk.content) + 300 + max_tokens,
+            desc=desc or f"Running {operation}"
+        )
+
+    def classify_and_summarize(self, chunks, desc=None):
+        self.run_chunks(chunks, "classify_relevance", max_tokens=5, desc=desc)
+        relevant = [chunk for chunk in chunks if chunk.relevance]
+        self.run_chunks(relevant, "summarize_record", desc=desc)
+
+    def summarize_knowledge(self, chunks, desc=None):
+        self.run_chunks(chunks, "summarize_knowledge", desc=desc)
@@ -0,0 +1,529 @@
+import os
+import json
+import atexit
+import threading
+from types import SimpleNamespace
+import numpy as np
+import config
+
+def _sparse_parts(vector):
+    if isinstance(vector, dict):
+        return vector["indices"], vector["values"]
+    return vector.indices, vector.values
+
+def _is_sparse(vector):
+    return hasattr(vector, "indices") or (isinstance(vector, dict) and "indices" in vector)
+
+def _split_vector(vector, dense_name, sparse_name):
+    # PointStruct vectors come as a plain list (unnamed dense) or a dict of named dense/sparse vectors.
+    if vector is None:
+        return None, None
+    if not isinstance(vector, dict):
+        return list(vector), None
+    dense = vector.get(dense_name)
+    sparse = vector.get(sparse_name) if sparse_name else None
+    if dense is not None and _is_sparse(dense):
+        dense = None
+    return dense, sparse
+
+def _normalized(block, dtype):
+    block = np.asarray(block, dtype=np.float32)
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (block / norms).astype(dtype)
+
+def _as_list(conditions):
+    if conditions is None:
+        return []
+    return conditions if isinstance(conditions, list) else [conditions]
+
+def reciprocal_rank_fusion(rankings, k, constant=60):
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (constant + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+def distribution_based_score_fusion(rankings, k):
+    # Like Qdrant's DBSF: each ranking's scores are scaled by mean +/- 3 std into [0, 1] and summed.
+    scores = {}
+    for ranking in rankings:
+        if not ranking:
+            continue
+        values = np.array([score for _, score in ranking])
+        low = values.mean() - 3 * values.std()
+        high = values.mean() + 3 * values.std()
+        for row, score in ranking:
+            normalized = float(np.clip((score - low) / (high - low), 0.0, 1.0)) if high > low else 0.5
+            scores[row] = scores.get(row, 0.0) + normalized
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+class LocalCollectionIndex:
+    def __init__(self, path, dense_name="", dim=None, sparse_name=None, dtype=None):
+        self.path = path
+        self.dense_name = dense_name
+        self.dim = dim
+        self.sparse_name = sparse_name
+        self.dtype = dtype or config.local_index_dtype
+        self.ids = []
+        self.payloads = []
+        self.row_of = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self.has_dense = np.zeros(0, dtype=bool)
+        # Dense rows are stored normalized (cosine only) in segments: memory-mapped .npy files, plus in-memory
+        # blocks of new rows until the next save writes them as one more file.
+        self.segments = []
+        self.segment_files = []
+        self.next_segment = 0
+        self.sparse_rows = []
+        self.pending_dense = []
+        self.replaced = []
+        self.columns = {}
+        self.postings = None
+        self.ivf = None
+        self.indexed_fields = {}
+        self.dirty = False
+
+    # --- storage ---------------------------------------------------------
+
+    def save(self):
+        self._compact()
+        self.dirty = False
+        os.makedirs(self.path, exist_ok=True)
+        self._save_segments()
+        meta = {
+            "dense_name": self.dense_name,
+            "dim": self.dim,
+            "sparse_name": self.sparse_name,
+            "dtype": self.dtype,
+            "ids": self.ids,
+            "indexed_fields": self.indexed_fields,
+            "segments": self.segment_files,
+            "next_segment": self.next_segment,
+        }
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        with open(os.path.join(self.path, "payloads.jsonl"), "w", encoding="utf-8") as f:
+            for payload in self.payloads:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        np.save(os.path.join(self.path, "alive.npy"), self.alive)
+        np.save(os.path.join(self.path, "has_dense.npy"), self.has_dense)
+        lengths = np.array([len(row[0]) for row in self.sparse_rows], dtype=np.int64)
+        np.save(os.path.join(self.path, "sparse_indptr.npy"), np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+        np.save(os.path.join(self.path, "sparse_indices.npy"), np.concatenate([np.asarray(row[0], dtype=np.int32) for row in self.sparse_rows]) if self.sparse_rows else np.zeros(0, dtype=np.int32))
+        np.save(os.path.join(self.path, "sparse_values.npy"), np.concatenate([np.asarray(row[1], dtype=np.float32) for row in self.sparse_rows]) if self.sparse_rows else np.zeros(0, dtype=np.float32))
+
+    def _segment_path(self, file_name):
+        return os.path.join(self.path, file_name)
+
+    def _new_segment_file(self):
+        file_name = f"dense_{self.next_segment}.npy"
+        self.next_segment += 1
+        return file_name
+
+    def _save_segments(self):
+        # Only rows added since the last save are written; existing segment files are never rewritten here.
+        unsaved = [i for i, file_name in enumerate(self.segment_files) if file_name is None]
+        if unsaved:
+            file_name = self._new_segment_file()
+            np.save(self._segment_path(file_name), np.concatenate([self.segments[i] for i in unsaved]))
+            self.segments = self.segments[:unsaved[0]] + [np.load(self._segment_path(file_name), mmap_mode="r")]
+            self.segment_files = self.segment_files[:unsaved[0]] + [file_name]
+        if len(self.segment_files) > config.local_max_segments:
+            self._merge_segments()
+
+    def _merge_segments(self):
+        # Streams every segment into one new file, block by block, so merging never loads the matrix.
+        file_name = self._new_segment_file()
+        merged = np.lib.format.open_memmap(self._segment_path(file_name), mode="w+", dtype=self.dtype, shape=(self._rows(), self.dim))
+        start = 0
+        for segment in self.segments:
+            for block_start in range(0, len(segment), config.local_block_rows):
+                block = segment[block_start:block_start + config.local_block_rows]
+                merged[start:start + len(block)] = block
+                start += len(block)
+        merged.flush()
+        del merged
+        old_files = self.segment_files
+        self.segments = [np.load(self._segment_path(file_name), mmap_mode="r")]
+        self.segment_files = [file_name]
+        for old_file in old_files:
+            os.remove(self._segment_path(old_file))
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(path, meta["dense_name"], meta["dim"], meta["sparse_name"], meta["dtype"])
+        index.ids = meta["ids"]
+        index.indexed_fields = meta.get("indexed_fields", {})
+        index.row_of = {point_id: row for row, point_id in enumerate(index.ids)}
+        with open(os.path.join(path, "payloads.jsonl"), "r", encoding="utf-8") as f:
+            index.payloads = [json.loads(line) for line in f]
+        index.alive = np.load(os.path.join(path, "alive.npy"))
+        index.has_dense = np.load(os.path.join(path, "has_dense.npy"))
+        index.next_segment = meta.get("next_segment", 0)
+        indptr = np.load(os.path.join(path, "sparse_indptr.npy"))
+        indices = np.load(os.path.join(path, "sparse_indices.npy"))
+        values = np.load(os.path.join(path, "sparse_values.npy"))
+        index.sparse_rows = [(indices[indptr[i]:indptr[i + 1]], values[indptr[i]:indptr[i + 1]]) for i in range(len(indptr) - 1)]
+        if "segments" in meta:
+            index.segment_files = meta["segments"]
+            index.segments = [np.load(index._segment_path(file_name), mmap_mode="r") for file_name in index.segment_files]
+        else:
+            index._convert_legacy_dense()
+        return index
+
+    def _convert_legacy_dense(self):
+        # Older indexes kept one unnormalized dense.npy; it is normalized into a segment once, block by block.
+        legacy_path = self._segment_path("dense.npy")
+        legacy = np.load(legacy_path, mmap_mode="r")
+        if len(legacy):
+            file_name = self._new_segment_file()
+            segment = np.lib.format.open_memmap(self._segment_path(file_name), mode="w+", dtype=self.dtype, shape=legacy.shape)
+            for start in range(0, len(legacy), config.local_block_rows):
+                segment[start:start + config.local_block_rows] = _normalized(legacy[start:start + config.local_block_rows], self.dtype)
+            segment.flush()
+            del segment
+            self.segments = [np.load(self._segment_path(file_name), mmap_mode="r")]
+            self.segment_files = [file_name]
+        del legacy
+        # The new layout is saved before the old file goes, so an interrupted conversion can simply run again.
+        self.save()
+        os.remove(legacy_path)
+        print(f"Converted {self.path} to normalized dense segments.")
+
+    # --- writes ----------------------------------------------------------
+
+    def upsert(self, points):
+        for point in points:
+            dense, sparse = _split_vector(point.vector, self.dense_name, self.sparse_name)
+            point_id = str(point.id)
+            if point_id in self.row_of:
+                self.replaced.append(self.row_of[point_id])
+            row = len(self.ids)
+            self.row_of[point_id] = row
+            self.ids.append(point_id)
+            self.payloads.append(point.payload or {})
+            self.pending_dense.append(dense)
+            self.sparse_rows.append(_sparse_parts(sparse) if sparse is not None else ([], []))
+        self._invalidate()
+
+    def delete(self, point_ids):
+        self._compact()
+        for point_id in point_ids:
+            row = self.row_of.pop(str(point_id), None)
+            if row is not None:
+                self.alive[row] = False
+        self._invalidate()
+
+    def _invalidate(self):
+        self.columns = {}
+        self.postings = None
+        self.ivf = None
+        self.dirty = True
+
+    def _rows(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def _compact(self):
+        # New rows become one more in-memory segment; stored segments are left as they are.
+        if not self.pending_dense:
+            return
+        new_rows = len(self.pending_dense)
+        block = np.zeros((new_rows, self.dim), dtype=np.float32)
+        present = np.zeros(new_rows, dtype=bool)
+        for i, dense in enumerate(self.pending_dense):
+            if dense is not None:
+                block[i] = dense
+                present[i] = True
+        self.segments.append(_normalized(block, self.dtype))
+        self.segment_files.append(None)
+        self.has_dense = np.concatenate([self.has_dense, present])
+        self.alive = np.concatenate([self.alive, np.ones(new_rows, dtype=bool)])
+        self.alive[self.replaced] = False
+        self.pending_dense = []
+        self.replaced = []
+
+    def _dense_rows(self, rows):
+        # Reads the given rows (ascending) from their segments as float32.
+        starts = np.cumsum([0] + [len(segment) for segment in self.segments])
+        segment_of = np.searchsorted(starts, rows, side="right") - 1
+        block = np.empty((len(rows), self.dim), dtype=np.float32)
+        for segment in np.unique(segment_of):
+            selected = segment_of == segment
+            block[selected] = self.segments[segment][rows[selected] - starts[segment]]
+        return block
+
+    def _blocks(self, rows):
+        for start in range(0, len(rows), config.local_block_rows):
+            chunk = rows[start:start + config.local_block_rows]
+            yield chunk, self._dense_rows(chunk)
+
+    def _scores(self, rows, query):
+        # Scored block by block straight from the segments, so only one block is ever copied into memory.
+        scores = np.empty(len(rows), dtype=np.float32)
+        start = 0
+        for chunk, block in self._blocks(rows):
+            scores[start:start + len(chunk)] = block @ query
+            start += len(chunk)
+        return scores
+
+    # --- filters ---------------------------------------------------------
+
+    def _column(self, key):
+        if key not in self.columns:
+            self.columns[key] = np.array([payload.get(key) if payload else None for payload in self.payloads], dtype=object)
+        return self.columns[key]
+
+    def _condition_mask(self, condition):
+        if hasattr(condition, "must") or hasattr(condition, "should"):
+            return self.filter_mask(condition)
+        column = self._column(condition.key)
+        if condition.match is not None:
+            if hasattr(condition.match, "any"):
+                allowed = set(condition.match.any)
+                return np.array([value in allowed for value in column], dtype=bool)
+            return column == condition.match.value
+        if condition.range is not None:
+            numbers = np.array([value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan for value in column], dtype=float)
+            mask = ~np.isnan(numbers)
+            bounds = condition.range
+            with np.errstate(invalid="ignore"):
+                if bounds.gte is not None:
+                    mask &= numbers >= bounds.gte
+                if bounds.gt is not None:
+                    mask &= numbers > bounds.gt
+                if bounds.lte is not None:
+                    mask &= numbers <= bounds.lte
+                if bounds.lt is not None:
+                    mask &= numbers < bounds.lt
+            return mask
+        raise ValueError(f"Unsupported local filter condition on {condition.key}")
+
+    def filter_mask(self, filter):
+        mask = np.ones(len(self.ids), dtype=bool)
+        if filter is None:
+            return mask
+        for condition in _as_list(filter.must):
+            mask &= self._condition_mask(condition)
+        should = _as_list(filter.should)
+        if should:
+            any_mask = np.zeros(len(self.ids), dtype=bool)
+            for condition in should:
+                any_mask |= self._condition_mask(condition)
+            mask &= any_mask
+        for condition in _as_list(filter.must_not):
+            mask &= ~self._condition_mask(condition)
+        return mask
+
+    # --- search ----------------------------------------------------------
+
+    def _build_ivf(self, rows):
+        # Coarse k-means trained on a sample of the live dense rows; every row is then assigned block by block.
+        lists = min(config.local_ivf_lists, max(1, len(rows) // 39))
+        generator = np.random.default_rng(0)
+        sample = np.sort(generator.choice(rows, size=min(len(rows), lists * 32), replace=False))
+        vectors = self._dense_rows(sample)
+        centroids = vectors[generator.choice(len(sample), size=lists, replace=False)]
+        for _ in range(10):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            for cluster in range(lists):
+                members = vectors[assignment == cluster]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+        assignment = np.concatenate([np.argmax(block @ centroids.T, axis=1) for _, block in self._blocks(rows)])
+        self.ivf = (centroids, [rows[assignment == cluster] for cluster in range(lists)])
+
+    def search_dense(self, query_vector, k, filter=None, exact=None):
+        self._compact()
+        if not len(self.ids):
+            return []
+        exact = config.local_exact_search if exact is None else exact
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        mask = self.alive & self.has_dense & self.filter_mask(filter)
+
+        candidates = np.flatnonzero(mask)
+        if not exact and len(candidates) >= config.local_ivf_min_points:
+            if self.ivf is None:
+                self._build_ivf(np.flatnonzero(self.alive & self.has_dense))
+            centroids, lists = self.ivf
+            probes = np.argsort(-(centroids @ query))[:config.local_ivf_probes]
+            probed = np.concatenate([lists[probe] for probe in probes])
+            candidates = np.sort(probed[mask[probed]])
+        if not len(candidates):
+            return []
+        scores = self._scores(candidates, query)
+        order = np.argsort(-scores)[:k]
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+
+    def _build_postings(self):
+        rows = np.concatenate([np.full(len(indices), row, dtype=np.int64) for row, (indices, _) in enumerate(self.sparse_rows)]) if self.sparse_rows else np.zeros(0, dtype=np.int64)
+        terms = np.concatenate([np.asarray(indices, dtype=np.int64) for indices, _ in self.sparse_rows]) if self.sparse_rows else np.zeros(0, dtype=np.int64)
+        values = np.concatenate([np.asarray(values, dtype=np.float32) for _, values in self.sparse_rows]) if self.sparse_rows else np.zeros(0, dtype=np.float32)
+        order = np.argsort(terms, kind="stable")
+        terms, rows, values = terms[order], rows[order], values[order]
+        unique_terms, starts = np.unique(terms, return_index=True)
+        ends = np.append(starts[1:], len(terms))
+        self.postings = ({int(term): (start, end) for term, start, end in zip(unique_terms, starts, ends)}, rows, values)
+
+    def search_sparse(self, indices, values, k, filter=None):
+        self._compact()
+        if not len(self.ids):
+            return []
+        if self.postings is None:
+            self._build_postings()
+        spans, posting_rows, posting_values = self.postings
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term, weight in zip(indices, values):
+            span = spans.get(int(term))
+            if span is not None:
+                np.add.at(scores, posting_rows[span[0]:span[1]], posting_values[span[0]:span[1]] * weight)
+        mask = self.alive & self.filter_mask(filter) & (scores > 0)
+        candidates = np.flatnonzero(mask)
+        order = np.argsort(-scores[candidates])[:k]
+        return [(int(candidates[i]), float(scores[candidates[i]])) for i in order]
+
+    def record(self, row, with_payload=True, with_vectors=False, score=None):
+        vector = None
+        if with_vectors:
+            self._compact()
+            vectors = {}
+            if self.has_dense[row]:
+                vectors[self.dense_name] = self._dense_rows(np.array([row]))[0].tolist()
+            indices, values = self.sparse_rows[row]
+            if len(indices) and self.sparse_name:
+                vectors[self.sparse_name] = SimpleNamespace(indices=list(map(int, indices)), values=list(map(float, values)))
+            vector = vectors.get("") if list(vectors) == [""] else vectors
+        return SimpleNamespace(
+            id=self.ids[row],
+            payload=self.payloads[row] if with_payload else None,
+            vector=vector,
+            score=score
+        )
+
+class LocalClient:
+    """Embedded stand-in for the QdrantClient calls made by vector_store."""
+
+    def __init__(self, path=None):
+        self.path = path or config.local_index_path
+        self.collections = {}
+        self._lock = threading.RLock()
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if os.path.exists(os.path.join(self.path, name, "meta.json")):
+                    self.collections[name] = LocalCollectionIndex.load(os.path.join(self.path, name))
+        # Writes are buffered in memory and persisted on flush, or at exit at the latest.
+        atexit.register(self.flush)
+
+    def flush(self, collection_name=None):
+        with self._lock:
+            names = [collection_name] if collection_name else list(self.collections)
+            for name in names:
+                index = self.collections.get(name)
+                if index is not None and index.dirty:
+                    index.save()
+
+    def collection_exists(self, collection_name):
+        return collection_name in self.collections
+
+    def get_index(self, collection_name):
+        return self.collections[collection_name]
+
+    def create_collection(self, collection_name, vectors_config, sparse_vectors_config=None, **kwargs):
+        if isinstance(vectors_config, dict):
+            dense_name, params = next(iter(vectors_config.items()))
+        else:
+            dense_name, params = "", vectors_config
+        sparse_name = next(iter(sparse_vectors_config)) if sparse_vectors_config else None
+        with self._lock:
+            index = LocalCollectionIndex(os.path.join(self.path, collection_name), dense_name, params.size, sparse_name)
+            self.collections[collection_name] = index
+            index.save()
+
+    def delete_collection(self, collection_name):
+        with self._lock:
+            index = self.collections.pop(collection_name, None)
+            if index is not None and os.path.isdir(index.path):
+                for file_name in os.listdir(index.path):
+                    os.remove(os.path.join(index.path, file_name))
+                os.rmdir(index.path)
+
+    def create_payload_index(self, collection_name, field_name, field_schema=None, **kwargs):
+        with self._lock:
+            index = self.collections[collection_name]
+            index.indexed_fields[field_name] = str(getattr(field_schema, "value", field_schema))
+
+    def upsert(self, collection_name, points, **kwargs):
+        with self._lock:
+            self.collections[collection_name].upsert(points)
+
+    def upload_points(self, collection_name, points, **kwargs):
+        self.upsert(collection_name, list(points))
+
+    def delete(self, collection_name, points_selector, **kwargs):
+        point_ids = getattr(points_selector, "points", points_selector)
+        with self._lock:
+            self.collections[collection_name].delete(point_ids)
+
+    def retrieve(self, collection_name, ids, with_payload=True, with_vectors=False, **kwargs):
+        with self._lock:
+            index = self.collections[collection_name]
+            rows = [index.row_of[str(point_id)] for point_id in ids if str(point_id) in index.row_of]
+            return [index.record(row, with_payload, with_vectors) for row in rows]
+
+    def scroll(self, collection_name, limit=10, offset=None, with_payload=True, with_vectors=False, **kwargs):
+        # Offsets are row numbers; returns (records, next_offset) like QdrantClient.scroll.
+        with self._lock:
+            index = self.collections[collection_name]
+            index._compact()
+            rows = np.flatnonzero(index.alive[int(offset or 0):]) + int(offset or 0)
+            records = [index.record(int(row), with_payload, with_vectors) for row in rows[:limit]]
+            return records, (int(rows[limit]) if len(rows) > limit else None)
+
+    def count(self, collection_name, **kwargs):
+        index = self.collections[collection_name]
+        index._compact()
+        return SimpleNamespace(count=int(index.alive.sum()))
+
+class LocalCollection:
+    """Mirrors the QdrantVectorStore search calls Retriever makes, backed by a LocalClient."""
+
+    def __init__(self, client, collection_name, dense_embedding_function, sparse_embedding_function=None, retrieval_mode="hybrid"):
+        self.client = client
+        self.collection_name = collection_name
+        self.dense_embedding_function = dense_embedding_function
+        self.sparse_embedding_function = sparse_embedding_function
+        self.retrieval_mode = str(getattr(retrieval_mode, "value", retrieval_mode)).lower()
+
+    def _document(self, index, row, score):
+        from langchain_core.documents import Document
+        payload = index.payloads[row] or {}
+        metadata = dict(payload.get("metadata") or {})
+        metadata["_id"] = index.ids[row]
+        metadata["_collection_name"] = self.collection_name
+        return Document(page_content=payload.get("page_content") or "", metadata=metadata), score
+
+    def similarity_search_with_score(self, query, k=4, filter=None, exact=None, hybrid_fusion=None, **kwargs):
+        index = self.client.get_index(self.collection_name)
+        rankings = []
+        if self.retrieval_mode in ("dense", "hybrid"):
+            query_vector = self.dense_embedding_function.embed_query(query)
+            rankings.append(index.search_dense(query_vector, k, filter, exact))
+        if self.retrieval_mode in ("sparse", "hybrid") and index.sparse_name:
+            sparse = self.sparse_embedding_function.embed_query(query)
+            rankings.append(index.search_sparse(sparse.indices, sparse.values, k, filter))
+
+        fusion = str(getattr(getattr(hybrid_fusion, "fusion", None), "value", None) or config.hybrid_fusion).lower()
+        if len(rankings) == 1:
+            results = rankings[0]
+        elif fusion == "dbsf":
+            results = distribution_based_score_fusion(rankings, k)
+        else:
+            results = reciprocal_rank_fusion([[row for row, _ in ranking] for ranking in rankings], k)
+        return [self._document(index, row, score) for row, score in results]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, **kwargs)]
@@ -0,0 +1,76 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+import config
+
+STAGES = ["extracted", "chunked", "classified", "summarized", "embedded"]
+POINT_NAMESPACE = uuid.UUID("6f1f3c0e-8b9a-4d55-9a43-2f0c7a1b5e11")
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def point_id(*parts):
+    return str(uuid.uuid5(POINT_NAMESPACE, ":".join(str(part) for part in parts)))
+
+class Manifest:
+    def __init__(self, path=None):
+        self.path = path or config.manifest_path
+        self.items = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.items = json.load(f).get("items", {})
+
+    def entry(self, key):
+        return self.items.get(key)
+
+    def is_done(self, key, digest, stage):
+        entry = self.items.get(key)
+        return (
+            entry is not None
+            and entry["hash"] == digest
+            and STAGES.index(entry["stage"]) >= STAGES.index(stage)
+        )
+
+    def mark(self, key, digest, stage, **fields):
+        with self._lock:
+            entry = self.items.get(key)
+            if entry is None or entry["hash"] != digest:
+                entry = {}
+            entry.update(fields, hash=digest, stage=stage)
+            self.items[key] = entry
+
+    def remove(self, key):
+        with self._lock:
+            return self.items.pop(key, None)
+
+    def keys(self, prefix=""):
+        return [key for key in self.items if key.startswith(prefix)]
+
+    def pending_files(self, paths, stage):
+        # Source files that are new, changed, or have not reached the stage yet.
+        return [path for path in paths if not self.is_done(f"file:{path}", file_hash(path), stage)]
+
+    def mark_file(self, path, stage):
+        self.mark(f"file:{path}", file_hash(path), stage)
+
+    def removed_files(self, paths):
+        current = {f"file:{path}" for path in paths}
+        return [key[len("file:"):] for key in self.keys("file:") if key not in current]
+
+    def save(self):
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"items": self.items}, f)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,18 @@
+import argparse
+import vector_store as vs
+import manifest as mf
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the dense-only and sparse-only twin points of a legacy collection into single hybrid points.")
+    parser.add_argument("collections", nargs="+")
+    parser.add_argument("--manifest", default=None, help="Manifest whose point ids should follow the migration.")
+    parser.add_argument("--backend", default=None, choices=["qdrant", "local"])
+    parser.add_argument("--local-path", default=None)
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    if args.backend:
+        vs.set_backend(args.backend, args.local_path)
+    manifest = mf.Manifest(args.manifest) if args.manifest else None
+    for collection_name in args.collections:
+        vs.migrate_collection(collection_name, manifest=manifest, batch_size=args.batch_size)
@@ -0,0 +1,121 @@
+import threading
+import time
+import config
+
+def _load_splade(model_name):
+    from fastembed import SparseTextEmbedding
+    return SparseTextEmbedding(model_name=model_name)
+
+def _load_cross_encoder(model_name):
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name)
+
+def _load_cross_encoder_onnx(model_name):
+    # Quantized ONNX export run through onnxruntime on CPU.
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name, backend="onnx", model_kwargs={"file_name": config.cross_encoder_onnx_file})
+
+def _load_fastembed_sparse(model_name):
+    from langchain_qdrant import FastEmbedSparse
+    return FastEmbedSparse(model_name=model_name)
+
+def default_kinds():
+    # The kinds the configured pipeline uses; the ONNX cross-encoder only when rerank_backend asks for it.
+    return ["splade", "fastembed_sparse", "cross_encoder_onnx" if config.rerank_backend == "onnx" else "cross_encoder"]
+
+class ModelRegistry:
+    def __init__(self, idle_seconds=None, max_models=None):
+        self.idle_seconds = idle_seconds if idle_seconds is not None else config.model_idle_seconds
+        self.max_models = max_models if max_models is not None else config.max_loaded_models
+        self.loaders = {
+            "splade": (_load_splade, config.sparse_model),
+            "cross_encoder": (_load_cross_encoder, config.cross_encoder_model),
+            "cross_encoder_onnx": (_load_cross_encoder_onnx, config.cross_encoder_model),
+            "fastembed_sparse": (_load_fastembed_sparse, config.sparse_model),
+        }
+        self.models = {}
+        self.last_used = {}
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._next_sweep = 0.0
+
+    def register(self, kind, loader, default_name=None):
+        self.loaders[kind] = (loader, default_name)
+
+    def get(self, kind, model_name=None):
+        loader, default_name = self.loaders[kind]
+        key = (kind, model_name or default_name)
+        with self._lock:
+            model = self.models.get(key)
+            if model is not None:
+                now = time.monotonic()
+                self.last_used[key] = now
+                self.metrics[key]["hits"] += 1
+                # Warm processes only ever hit, so idle models are swept here too, at most once a second.
+                if now >= self._next_sweep:
+                    self._evict_locked(now, self.idle_seconds)
+                return model
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so different models can load concurrently.
+        with key_lock:
+            with self._lock:
+                model = self.models.get(key)
+            if model is None:
+                start = time.perf_counter()
+                model = loader(key[1])
+                load_seconds = time.perf_counter() - start
+                print(f"Loaded {key[1]} in {load_seconds:.2f}s")
+                with self._lock:
+                    self.models[key] = model
+                    stats = self.metrics.setdefault(key, {"loads": 0, "load_seconds": 0.0, "hits": 0})
+                    stats["loads"] += 1
+                    stats["load_seconds"] += load_seconds
+            with self._lock:
+                self.last_used[key] = time.monotonic()
+        self.evict()
+        return model
+
+    def warm_up(self, kinds=None):
+        for kind in kinds or default_kinds():
+            self.get(kind)
+
+    def evict(self, idle_seconds=None):
+        idle_seconds = self.idle_seconds if idle_seconds is None else idle_seconds
+        with self._lock:
+            return self._evict_locked(time.monotonic(), idle_seconds)
+
+    def _evict_locked(self, now, idle_seconds):
+        self._next_sweep = now + 1.0
+        by_age = sorted(self.models, key=lambda key: self.last_used.get(key, 0.0))
+        evicted = [key for key in by_age if now - self.last_used.get(key, 0.0) > idle_seconds]
+        remaining = [key for key in by_age if key not in evicted]
+        if self.max_models:
+            evicted.extend(remaining[:max(0, len(remaining) - self.max_models)])
+        for key in evicted:
+            del self.models[key]
+            self.last_used.pop(key, None)
+        if evicted:
+            print(f"Evicted idle models: {', '.join(name for _, name in evicted)}")
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self.models.clear()
+            self.last_used.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                f"{kind}:{name}": dict(stats, loaded=(kind, name) in self.models)
+                for (kind, name), stats in self.metrics.items()
+            }
+
+registry = ModelRegistry()
+
+def get_model(kind, model_name=None):
+    return registry.get(kind, model_name)
+
+def warm_up(kinds=None):
+    registry.warm_up(kinds)
@@ -1,23 +1,30 @@
-import fitz
 import os
 import util
-from llama_index.core.node_parser import SentenceSplitter
-from openai import OpenAI
+import config
+import manifest as mf
+import instrumentation as inst
+import clients
+import llm_executor
 import re
-import api
+import bisect
 import json
 from tqdm import tqdm
 
-openai_client = OpenAI(api_key=api.OPENAI_API)
-
 class Chunk:
-    def __init__(self, content, relevance=None, summary=None):
+    __slots__ = ("content", "relevance", "summary", "source_path", "pages", "start", "end", "key")
+
+    def __init__(self, content, relevance=None, summary=None, source_path=None, pages=None, start=None, end=None, key=None):
         self.content = content
         self.relevance = relevance
         self.summary = summary
+        self.source_path = source_path
+        self.pages = pages
+        self.start = start
+        self.end = end
+        self.key = key
 
-    def classify_relevance(self):
-        prompt = f"""
+    def relevance_prompt(self):
+        return f"""
         You are a text classifier specialized in policy analysis. Your task is to determine whether the provided text contains information relevant to climate policies. For this task, "climate policies" include any discussion about governmental, international, or organizational decisions, strategies, or actions aimed at addressing climate change. Relevant topics include (but are not limited to) carbon taxes, renewable energy initiatives, climate agreements (e.g., the Paris Agreement), emissions regulations, and adaptation/mitigation strategies.
 
         Instructions:
@@ -39,8 +46,12 @@ class Chunk:
         \"\"\"{self.content}\"\"\"
         """
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
+    @inst.timed("chunk.classify_relevance")
+    def classify_relevance(self, client=None):
+        client = client or clients.openai()
+        prompt = self.relevance_prompt()
+        response = client.chat.completions.create(
+            model=config.llm_model,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
                 {"role": "user", "content": prompt}
@@ -48,15 +59,18 @@ class Chunk:
             temperature=0.0,  
             max_tokens=5,     
         )
+        inst.record_usage("chunk.classify_relevance", response)
 
         raw_answer = response.choices[0].message.content.strip()
         match = re.search(r'[01]', raw_answer)
         if match:
-            self.relevance = 1
+            self.relevance = int(match.group())
         else:
             self.relevance = 0
             
-    def summarize_record(self):
+    @inst.timed("chunk.summarize_record")
+    def summarize_record(self, client=None):
+        client = client or clients.openai()
         prompt = f"""
         You are an expert in extracting information. Your task is to provide a detailed summary of:
         • The policy or policies mentioned
@@ -79,8 +93,8 @@ class Chunk:
 
         Summary:
         """
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",  
+        response = client.chat.completions.create(
+            model=config.llm_model,  
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
                 {"role": "user", "content": prompt}
@@ -88,9 +102,12 @@ class Chunk:
             temperature=0.3,  
             max_tokens=300   
         )
+        inst.record_usage("chunk.summarize_record", response)
         self.summary = response.choices[0].message.content.strip()
 
-    def summarize_knowledge(self):
+    @inst.timed("chunk.summarize_knowledge")
+    def summarize_knowledge(self, client=None):
+        client = client or clients.openai()
         prompt = f"""
         You are an expert in extracting information. Your task is to provide a summary of the given context using bullet points.
         The given context is from a manual introducing knowledges of climates or possible effects of climate.
@@ -100,8 +117,8 @@ class Chunk:
 
         Summary:
         """
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",  
+        response = client.chat.completions.create(
+            model=config.llm_model,  
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
                 {"role": "user", "content": prompt}
@@ -109,12 +126,100 @@ class Chunk:
             temperature=0.3,  
             max_tokens=300   
         )
+        inst.record_usage("chunk.summarize_knowledge", response)
         self.summary = response.choices[0].message.content.strip()
         
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
     @classmethod
     def from_dict(cls, data):
         return cls(**data)
     
+def packed_relevance_prompt(chunks):
+    segments = "\n\n".join(f"Segment {i + 1}:\n\"\"\"{chunk.content}\"\"\"" for i, chunk in enumerate(chunks))
+    return f"""
+        You are a text classifier specialized in policy analysis. Your task is to determine, for each numbered segment below, whether it contains information relevant to climate policies. For this task, "climate policies" include any discussion about governmental, international, or organizational decisions, strategies, or actions aimed at addressing climate change. Relevant topics include (but are not limited to) carbon taxes, renewable energy initiatives, climate agreements (e.g., the Paris Agreement), emissions regulations, and adaptation/mitigation strategies.
+
+        Instructions:
+        1. Read each segment carefully and classify it independently of the others.
+        2. If a segment includes any discussion of policies, decisions, or actions related to climate change, classify it as 1.
+        3. If a segment does not mention any such information, classify it as 0.
+        4. Do not provide any explanations. Answer with exactly one JSON list of {len(chunks)} integers, one per segment in order, e.g. [1, 0, 1].
+
+        Segments:
+
+        {segments}
+        """
+
+def parse_packed_relevance(raw_answer, size):
+    match = re.search(r'\[[\s\d,]*\]', raw_answer)
+    if not match:
+        return None
+    try:
+        labels = json.loads(match.group())
+    except json.JSONDecodeError:
+        return None
+    if len(labels) != size or any(label not in (0, 1) for label in labels):
+        return None
+    return labels
+
+def _usage_tokens(response, prompt, completion):
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None):
+        return usage.total_tokens
+    return (len(prompt) + len(completion)) // 4
+
+@inst.timed("chunk.classify_relevance_pack")
+def classify_relevance_pack(chunks, client=None):
+    client = client or clients.openai()
+    prompt = packed_relevance_prompt(chunks)
+    response = client.chat.completions.create(
+        model=config.llm_model,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.0,
+        max_tokens=4 * len(chunks) + 10,
+    )
+    inst.record_usage("chunk.classify_relevance_pack", response)
+    raw_answer = response.choices[0].message.content.strip()
+    stats = {"requests": 1, "tokens": _usage_tokens(response, prompt, raw_answer), "fallbacks": 0}
+
+    labels = parse_packed_relevance(raw_answer, len(chunks))
+    if labels is None:
+        for chunk in chunks:
+            chunk.classify_relevance(client=client)
+        stats["requests"] += len(chunks)
+        stats["tokens"] += sum((len(chunk.relevance_prompt()) // 4) + 5 for chunk in chunks)
+        stats["fallbacks"] += 1
+    else:
+        for chunk, label in zip(chunks, labels):
+            chunk.relevance = label
+    return stats
+
+def clean_page_text(page):
+    text = page.get_text()
+    lines = text.split('\n')
+    non_empty_lines = [line for line in lines if line.strip()]
+    return '\n'.join(non_empty_lines)
+
+def write_pages(doc, f, start_page=0, end_page=None, offset=0):
+    # Streams cleaned page text to f and returns the character span of every page.
+    end_page = len(doc) if end_page is None else end_page
+    pages = []
+    for page_num in range(start_page, end_page):
+        cleaned_text = clean_page_text(doc.load_page(page_num))
+        f.write(cleaned_text)
+        pages.append({"page": page_num, "start": offset, "end": offset + len(cleaned_text)})
+        offset += len(cleaned_text)
+    return pages
+
+def save_page_offsets(pdf_path, pages, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"source": pdf_path, "pages": pages}, f)
+
 class PDF:
     def __init__(self, pdf_path):
         self.pdf_path = pdf_path
@@ -124,50 +229,161 @@ class PDF:
         self.pdf_name = file_full_name.split('.')[0]
         self.content = ""
         self.chunks = []
+        self.page_offsets = []
+        self.duplicates = {}
 
-    def extract_text(self, output_folder:str):
-        os.makedirs(output_folder, exist_ok=True)
-        doc = fitz.open(self.pdf_path)
-        all_text = ""
-
-        print(f"Extracting texts from {self.pdf_name}.")
+    def text_path(self, output_folder):
+        return f"{output_folder}/{self.folder_name}/{self.pdf_name}.txt"
 
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text = page.get_text()
-            lines = text.split('\n')
-            non_empty_lines = [line for line in lines if line.strip()]
-            cleaned_text = '\n'.join(non_empty_lines)
-            all_text += cleaned_text
+    def pages_path(self, output_folder):
+        return f"{output_folder}/{self.folder_name}/{self.pdf_name}.pages.json"
 
-        self.content = all_text
+    @inst.timed("pdf.extract_text")
+    def extract_text(self, output_folder:str, keep_content=False):
         os.makedirs(f"{output_folder}/{self.folder_name}", exist_ok=True)
-        save_path = f"{output_folder}/{self.folder_name}/{self.pdf_name}.txt"
+        import fitz
+        doc = fitz.open(self.pdf_path)
+
+        print(f"Extracting texts from {self.pdf_name}.")
 
+        save_path = self.text_path(output_folder)
         with open(save_path, "w", encoding="utf-8") as f:
-            f.write(self.content)
+            self.page_offsets = write_pages(doc, f)
+        doc.close()
+        save_page_offsets(self.pdf_path, self.page_offsets, self.pages_path(output_folder))
+
+        if keep_content:
+            self.load_content(save_path)
         print(f"Extracted text saved to: {save_path}")
             
     def load_content(self, content_file):
         with open(content_file, "r", encoding="utf-8") as file:
             self.content = file.read()
+        pages_file = os.path.splitext(content_file)[0] + ".pages.json"
+        if os.path.exists(pages_file):
+            self.page_offsets = util.load_json(pages_file)["pages"]
         print(f"{self.pdf_name}'s content is loaded.")
 
+    def pages_for_span(self, start, end):
+        # Pages whose text overlaps the character span [start, end).
+        ends = [page["end"] for page in self.page_offsets]
+        first = bisect.bisect_right(ends, start)
+        pages = []
+        for page in self.page_offsets[first:]:
+            if page["start"] >= end and pages:
+                break
+            pages.append(page["page"])
+        return pages
+
+    @inst.timed("pdf.naive_chunking")
     def naive_chunking(self, chunk_size, overlap):
+        from llama_index.core.node_parser import SentenceSplitter
         text_splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
         splits = text_splitter.split_text(self.content)
         print(f"Total text chunks created: {len(splits)}")
         self.chunks = [Chunk(txt) for txt in splits]
 
+    def stream_chunks(self, text_folder, chunk_size=None, overlap=None):
+        # Reads the extracted text as a stream; each chunk knows its PDF, pages and character span.
+        import chunker
+        pages_path = self.pages_path(text_folder)
+        if not self.page_offsets and os.path.exists(pages_path):
+            self.page_offsets = util.load_json(pages_path)["pages"]
+        for text, start, end in chunker.chunk_file(self.text_path(text_folder), chunk_size, overlap):
+            yield Chunk(text, source_path=self.pdf_path, pages=self.pages_for_span(start, end), start=start, end=end)
+
+    @inst.timed("pdf.sentence_chunking")
+    def sentence_chunking(self, text_folder, chunk_size=None, overlap=None):
+        self.chunks = list(self.stream_chunks(text_folder, chunk_size, overlap))
+        print(f"Total text chunks created: {len(self.chunks)}")
+
     def save_chunks(self, output_folder):
-        data = [chunk.__dict__ for chunk in self.chunks]
+        data = [chunk.to_dict() for chunk in self.chunks]
         os.makedirs(f"{output_folder}/{self.folder_name}", exist_ok=True)
         with open(f"{output_folder}/{self.folder_name}/{self.pdf_name}.json", "w", encoding="utf-8") as f:
             json.dump(data, f, indent=4)
 
         print(f"Data written to {output_folder}/{self.folder_name}/{self.pdf_name}.json")
 
-    def filter_chunks_by_revelance(self):
+    def chunk_source(self):
+        return f"{self.folder_name}/{self.pdf_name}"
+
+    def store_chunks(self, store):
+        ids = store.add_many(self.chunks, self.chunk_source())
+        print(f"{len(ids)} chunks written to {store.file_path}")
+        return ids
+
+    def load_chunks(self, store):
+        self.chunks = list(store.iter_source(self.chunk_source()))
+
+    def classify_relevance_packed(self, pack_size=None, client=None, executor=None):
+        pack_size = pack_size or config.relevance_pack_size
+        packs = [self.chunks[i:i + pack_size] for i in range(0, len(self.chunks), pack_size)]
+        desc = f"Judging {self.pdf_name}'s chunks revelance in packs of {pack_size}"
+        if executor is not None:
+            results = executor.map(
+                lambda pack: classify_relevance_pack(pack, client or executor.client or clients.raw("openai")),
+                packs,
+                # Prompt, instructions and the label list the pack asks for, so token throttling sees the real size.
+                tokens=lambda pack: sum(llm_executor.estimate_tokens(chunk.content) for chunk in pack) + 300 + 4 * len(pack) + 10,
+                desc=desc
+            )
+        else:
+            results = [classify_relevance_pack(pack, client) for pack in tqdm(packs, desc=desc)]
+
+        stats = {
+            "requests": sum(result["requests"] for result in results),
+            "tokens": sum(result["tokens"] for result in results),
+            "fallbacks": sum(result["fallbacks"] for result in results),
+            "single_requests": len(self.chunks),
+            "single_tokens": sum(len(chunk.relevance_prompt()) // 4 + 5 for chunk in self.chunks),
+        }
+        saved_requests = stats["single_requests"] - stats["requests"]
+        saved_tokens = stats["single_tokens"] - stats["tokens"]
+        print(f"Packed classification used {stats['requests']} requests (saved {saved_requests}) and about {stats['tokens']} tokens (saved about {saved_tokens}).")
+        return stats
+
+    def deduplicate_chunks(self, deduplicator):
+        # Drops near-duplicate chunks, possibly across PDFs sharing the deduplicator, keeping provenance.
+        kept = []
+        for i, chunk in enumerate(self.chunks):
+            key = f"{self.folder_name}/{self.pdf_name}#{i}"
+            canonical = deduplicator.add(key, chunk.content)
+            if canonical is None:
+                chunk.key = key
+                kept.append(chunk)
+            else:
+                self.duplicates[key] = canonical
+        print(f"{len(self.chunks) - len(kept)} of {self.pdf_name}'s chunks are near-duplicates and were dropped.")
+        self.chunks = kept
+
+    def chunk_key(self, chunk):
+        return f"chunk:{self.folder_name}/{self.pdf_name}:{mf.content_hash(chunk.content)}"
+
+    def pending_chunks(self, manifest, stage):
+        # Restores LLM results of unchanged chunks and returns the chunks that still need the stage.
+        pending = []
+        for chunk in self.chunks:
+            key = self.chunk_key(chunk)
+            if manifest.is_done(key, key.rsplit(":", 1)[1], stage):
+                entry = manifest.entry(key)
+                chunk.relevance = entry.get("relevance", chunk.relevance)
+                chunk.summary = entry.get("summary", chunk.summary)
+            else:
+                pending.append(chunk)
+        print(f"{len(self.chunks) - len(pending)} of {self.pdf_name}'s chunks are unchanged.")
+        return pending
+
+    def mark_chunks(self, manifest, stage):
+        # Call before filter_chunks_by_revelance, otherwise dropped chunks are never marked and get classified again.
+        for chunk in self.chunks:
+            key = self.chunk_key(chunk)
+            manifest.mark(key, key.rsplit(":", 1)[1], stage, relevance=chunk.relevance, summary=chunk.summary)
+        manifest.save()
+
+    def filter_chunks_by_revelance(self, manifest=None, stage="summarized"):
+        if manifest is not None:
+            self.mark_chunks(manifest, stage)
         new_chunks = []
         counter = 0
         for chunk in tqdm(self.chunks, desc=f"Filtering {self.pdf_name}'s chunks."):
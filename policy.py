@@ -1,15 +1,26 @@
 import util
 import os
+import re
 import json
 from collections import defaultdict
 
+def parse_year(year):
+    # "2019", "2019-2021", "By 2030" -> first plausible year; "Nan" and empty -> None.
+    if isinstance(year, int):
+        return year
+    match = re.search(r'(?<!\d)(1[89]\d\d|20\d\d|2100)(?!\d)', str(year or ""))
+    return int(match.group()) if match else None
+
 class Policy:
-    def __init__(self, policy_id, policy=None, effect=None, country=None, year=None):
+    def __init__(self, policy_id, policy=None, effect=None, country=None, year=None, year_number=None, source_path=None, pages=None):
         self.policy_id = policy_id
         self.policy = policy
         self.effect = effect
         self.country = country
         self.year = year
+        self.year_number = year_number if year_number is not None else parse_year(year)
+        self.source_path = source_path
+        self.pages = pages
 
     def load_policy(self, item):
         summary = item['summary']
@@ -21,9 +32,17 @@ class Policy:
         country = seg3.split('Year:')[0].replace("\n","").strip()
         self.country = country.replace('/','')
         self.year = seg3.split('Year:')[-1].replace("\n","").strip()
+        self.year_number = parse_year(self.year)
+        self.source_path = item.get('source_path')
+        self.pages = item.get('pages')
     
     def save_policy(self, file_path):
         data = self.__dict__
+        if file_path.endswith(".jsonl"):
+            # Append-only PolicyStore file, no rewrite of earlier records.
+            with open(file_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+            return
         if os.path.exists(file_path):
             try:
                 with open(file_path, "r", encoding="utf-8") as f:
@@ -39,10 +58,112 @@ class Policy:
             json.dump(existing_data, f, indent=4)
         print(f"Data written to {file_path}")
 
+    def to_dict(self):
+        return dict(self.__dict__)
+
     @classmethod
     def from_dict(cls, data):
         return cls(**data)
 
+def group_key(value):
+    return str(value).replace('/','')
+
+def group_file_name(value):
+    if len(value) > 20:
+        value = value[:20]
+    return f"{value}.json"
+
+class PolicyStore:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.offsets = []
+        self.indexes = {"country": defaultdict(list), "year": defaultdict(list)}
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        if os.path.exists(file_path):
+            self._build_indexes()
+
+    def _build_indexes(self):
+        with open(self.file_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line), offset)
+                offset += len(line)
+
+    def _index(self, data, offset):
+        position = len(self.offsets)
+        self.offsets.append(offset)
+        for attribute, index in self.indexes.items():
+            index[group_key(data.get(attribute))].append(position)
+
+    def add(self, policy):
+        self.add_many([policy])
+
+    def add_many(self, policies):
+        with open(self.file_path, "ab") as f:
+            offset = f.tell()
+            for policy in policies:
+                data = policy.to_dict() if isinstance(policy, Policy) else dict(policy)
+                line = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                self._index(data, offset)
+                offset += len(line)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def get(self, positions):
+        with open(self.file_path, "rb") as f:
+            for position in positions:
+                f.seek(self.offsets[position])
+                yield json.loads(f.readline())
+
+    def find(self, attribute, value):
+        return list(self.get(self.indexes[attribute].get(group_key(value), [])))
+
+    def group_by(self, attribute, output_dir):
+        # One sequential pass; each record is routed to its group file using the index.
+        os.makedirs(output_dir, exist_ok=True)
+        group_of = {}
+        files = {}
+        for value, positions in self.indexes[attribute].items():
+            file_name = group_file_name(value)
+            for position in positions:
+                group_of[position] = file_name
+        try:
+            for position, data in enumerate(self):
+                file_name = group_of[position]
+                out = files.get(file_name)
+                if out is None:
+                    out = open(os.path.join(output_dir, file_name), "w", encoding="utf-8")
+                    out.write("[\n")
+                    files[file_name] = out
+                else:
+                    out.write(",\n")
+                out.write(json.dumps(data, indent=2, ensure_ascii=False))
+        finally:
+            for out in files.values():
+                out.write("\n]")
+                out.close()
+        print(f"Grouped data has been saved in '{output_dir}' directory.")
+
+    def export_json(self, file_path):
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(list(self), f, indent=4)
+        print(f"Data written to {file_path}")
+
+    @classmethod
+    def from_json(cls, json_path, file_path):
+        store = cls(file_path)
+        store.add_many(util.load_json(json_path) or [])
+        return store
+
 def group_by(attribute, input_file, output_dir):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -0,0 +1,47 @@
+import retrieval
+import chatbot
+
+def respond_text_query(
+        query,
+        policy_collection,
+        knowledge_collection,
+        txt_similarity_topk=30,
+        knowledge_similarity_topk=20,
+        cos_filtering_threshold=0.8,
+        txt_cos_filtering_topk=20,
+        knowledge_cos_filtering_topk=15,
+        cache=None,
+        max_context_tokens=None
+        ):
+
+    def compute(query):
+        policy_retriever = retrieval.Retriever(query, policy_collection)
+        policy_retriever.similarity_search(txt_similarity_topk)
+        policy_retriever.rerank(['policy','effect'])
+        policy_retriever.cos_filtering(['policy','effect'], cos_filtering_threshold, txt_cos_filtering_topk)
+
+        context = policy_retriever.passages(['policy','effect'])
+
+        knowledge_retriever = retrieval.Retriever(query, knowledge_collection)
+        knowledge_retriever.similarity_search(knowledge_similarity_topk)
+        knowledge_retriever.rerank('content')
+        knowledge_retriever.cos_filtering('content', cos_filtering_threshold, knowledge_cos_filtering_topk)
+
+        knowledge = knowledge_retriever.passages('content')
+
+        response = chatbot.answer_with_knowledge(query, context, knowledge, max_context_tokens)
+        context_ids = [doc.metadata["_id"] for doc in policy_retriever.reranked_docs + knowledge_retriever.reranked_docs]
+        return response, context_ids
+
+    if cache is None:
+        return compute(query)[0]
+    collections = [policy_collection.collection_name, knowledge_collection.collection_name]
+    params = {
+        "txt_similarity_topk": txt_similarity_topk,
+        "knowledge_similarity_topk": knowledge_similarity_topk,
+        "cos_filtering_threshold": cos_filtering_threshold,
+        "txt_cos_filtering_topk": txt_cos_filtering_topk,
+        "knowledge_cos_filtering_topk": knowledge_cos_filtering_topk,
+        "max_context_tokens": max_context_tokens,
+    }
+    return cache.get_or_compute(query, compute, collections, params)
@@ -0,0 +1,181 @@
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+import config
+import model_registry as mr
+
+def query_key(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()[:16]
+
+class ScoreCache:
+    def __init__(self, max_items=None):
+        self.max_items = config.rerank_cache_size if max_items is None else max_items
+        self.scores = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        with self._lock:
+            found = []
+            for key in keys:
+                score = self.scores.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self.scores.move_to_end(key)
+                found.append(score)
+            return found
+
+    def put_many(self, items):
+        if not self.max_items:
+            return
+        with self._lock:
+            for key, score in items:
+                self.scores[key] = score
+                self.scores.move_to_end(key)
+            while len(self.scores) > self.max_items:
+                self.scores.popitem(last=False)
+
+class RerankEngine:
+    """Cross-encoder scoring with a (query hash, doc id) score cache and micro-batching across concurrent queries."""
+
+    def __init__(self, model_name=None, backend=None, batch_size=None, max_wait=None, cache_size=None):
+        self.model_name = model_name
+        self.backend = backend or config.rerank_backend
+        self.batch_size = batch_size or config.rerank_batch_size
+        self.max_wait = config.rerank_max_wait if max_wait is None else max_wait
+        self.cache = ScoreCache(cache_size)
+        self.queue = queue.Queue()
+        self.active = 0
+        self.stats = {"requests": 0, "batches": 0, "pairs": 0}
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def model(self):
+        return mr.get_model("cross_encoder_onnx" if self.backend == "onnx" else "cross_encoder", self.model_name)
+
+    def _predict(self, pairs):
+        scores = self.model().predict(pairs, batch_size=self.batch_size)
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["pairs"] += len(pairs)
+        return [float(score) for score in scores]
+
+    def _submit(self, pairs):
+        future = Future()
+        if not self.max_wait:
+            future.set_result(self._predict(pairs))
+            return future
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        self.queue.put((pairs, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            # Only wait for more work while other callers are still in flight.
+            while size < self.batch_size and len(batch) < self.active:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            try:
+                scores = self._predict([pair for pairs, _ in batch for pair in pairs])
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            start = 0
+            for pairs, future in batch:
+                future.set_result(scores[start:start + len(pairs)])
+                start += len(pairs)
+
+    def score_many(self, requests):
+        # requests: [(query, [(doc_id, text), ...]), ...]; every uncached pair goes out in one submission.
+        keys, scores, pairs, missing = [], [], [], []
+        for r, (query, documents) in enumerate(requests):
+            request_keys = [(query_key(query), doc_id) for doc_id, _ in documents]
+            request_scores = self.cache.get_many(request_keys)
+            for i, score in enumerate(request_scores):
+                if score is None:
+                    missing.append((r, i))
+                    pairs.append((query, documents[i][1]))
+            keys.append(request_keys)
+            scores.append(request_scores)
+        with self._lock:
+            self.stats["requests"] += len(requests)
+        if pairs:
+            with self._lock:
+                self.active += 1
+            try:
+                computed = self._submit(pairs).result()
+            finally:
+                with self._lock:
+                    self.active -= 1
+            for (r, i), score in zip(missing, computed):
+                scores[r][i] = score
+            self.cache.put_many((keys[r][i], scores[r][i]) for r, i in missing)
+        return scores
+
+    def score(self, query, documents):
+        return self.score_many([(query, documents)])[0]
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(model_name=None):
+    with _engines_lock:
+        if model_name not in _engines:
+            _engines[model_name] = RerankEngine(model_name)
+        return _engines[model_name]
+
+def prune_candidates(docs, keep):
+    # keep: number of documents, or a fraction when below 1; ranked by the first-stage score.
+    if keep is None:
+        return list(docs)
+    if keep < 1:
+        keep = max(1, int(round(len(docs) * keep)))
+    return sorted(docs, key=lambda doc: doc.metadata.get("score", 0.0), reverse=True)[:int(keep)]
+
+def pruning_report(cases, levels, top_n=10, engine=None):
+    # cases: [(query, docs, contents)] with docs carrying metadata["score"]; compares each pruning level with a full rerank.
+    engine = engine or RerankEngine(cache_size=0, max_wait=0)
+    full_top = []
+    start = time.perf_counter()
+    for query, docs, contents in cases:
+        scores = engine.score(query, list(zip((doc.metadata["_id"] for doc in docs), contents)))
+        full_top.append({docs[i].metadata["_id"] for i in np.argsort(scores)[::-1][:top_n]})
+    full_seconds = time.perf_counter() - start
+
+    report = {"full": {"pairs": sum(len(docs) for _, docs, _ in cases), "ms_per_query": full_seconds * 1000 / max(1, len(cases)), f"recall@{top_n}": 1.0}}
+    for level in levels:
+        recalls = []
+        pairs = 0
+        start = time.perf_counter()
+        for (query, docs, contents), expected in zip(cases, full_top):
+            content_of = dict(zip((doc.metadata["_id"] for doc in docs), contents))
+            kept = prune_candidates(docs, level)
+            pairs += len(kept)
+            scores = engine.score(query, [(doc.metadata["_id"], content_of[doc.metadata["_id"]]) for doc in kept])
+            found = {kept[i].metadata["_id"] for i in np.argsort(scores)[::-1][:top_n]}
+            recalls.append(len(found & expected) / max(1, len(expected)))
+        seconds = time.perf_counter() - start
+        report[f"keep_{level}"] = {"pairs": pairs, "ms_per_query": seconds * 1000 / max(1, len(cases)), f"recall@{top_n}": float(np.mean(recalls)) if recalls else 0.0}
+        print(f"keep {level}: {report[f'keep_{level}']['ms_per_query']:.2f}ms/query, recall@{top_n} {report[f'keep_{level}'][f'recall@{top_n}']:.3f} vs full rerank ({report['full']['ms_per_query']:.2f}ms/query)")
+    return report
@@ -1,6 +1,9 @@
 import numpy as np
-from sentence_transformers import CrossEncoder
 import vector_store as vs
+import config
+import reranker as rr
+import context_builder as cb
+import instrumentation as inst
 
 class Retriever:
     def __init__(self, query, collection):
@@ -10,66 +13,146 @@ class Retriever:
         self.reranked_docs = []
         self.filtered_embeddings = []
         self.filtered_contents = []
+        self.filtered_docs = []
+        self.points = {}
 
+    @inst.timed("retriever.similarity_search")
     def similarity_search(self, k):
-        self.found_docs = self.collection.similarity_search(self.query, k=k, with_vectors=True)
+        results = self.collection.similarity_search_with_score(self.query, k=k, hybrid_fusion=vs.fusion_query(), with_vectors=True)
+        self.found_docs = keep_scores(results)
+        self.points = {}
 
+    @inst.timed("retriever.similarity_search")
     def similarity_search_with_filter(self, k, filter):
-        self.found_docs = self.collection.similarity_search(self.query, k=k, filter=filter, with_vectors=True)
-    
-    def rerank(self, attribute, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2"):
-        cross_encoder = CrossEncoder(model_name)
+        results = self.collection.similarity_search_with_score(self.query, k=k, filter=filter, hybrid_fusion=vs.fusion_query(), with_vectors=True)
+        self.found_docs = keep_scores(results)
+        self.points = {}
+
+    def fetch_points(self):
+        # One batched retrieve for all found documents, shared by rerank and cos_filtering.
+        if not self.points:
+            with inst.timer("retriever.fetch_points"):
+                self.points = vs.retrieve_points(self.found_docs, self.collection, with_vectors=True)
+        return self.points
+
+    def payload(self, doc):
+        point = self.fetch_points().get(doc.metadata["_id"])
+        return (point.payload if point else None) or {}
+
+    @inst.timed("retriever.rerank")
+    def rerank(self, attribute, model_name=None, keep=None, engine=None):
+        # Only the best `keep` first-stage candidates are scored; pruned ones are left out of reranked_docs.
+        engine = engine or rr.get_engine(model_name)
+        candidates = rr.prune_candidates(self.found_docs, keep if keep is not None else config.rerank_keep)
         rerank_input = []
-        for document in self.found_docs:
-            payload = vs.retrieve_payload(document, self.collection)
-            if isinstance(attribute, list):
-                content = ""
-                for item in attribute:
-                    value = payload.get(item, "")
-                    content += value
-            else:
-                content = payload.get(attribute, "")
-            rerank_input.append((self.query, content))
-        scores = cross_encoder.predict(rerank_input)
-
-        for i, doc in enumerate(self.found_docs):
+        for document in candidates:
+            content = get_content(self.payload(document), attribute)
+            rerank_input.append((f"{document.metadata['_id']}:{attribute}", content))
+        scores = engine.score(self.query, rerank_input)
+
+        for i, doc in enumerate(candidates):
             doc.metadata["cross_score"] = scores[i]
 
         self.reranked_docs = sorted(
-            self.found_docs,
+            candidates,
             key=lambda x: x.metadata["cross_score"],
             reverse=True
         )
 
-    def cos_filtering(self, attribute, threshold, k):
+    @inst.timed("retriever.cos_filtering")
+    def cos_filtering(self, attribute, threshold, k, mode="threshold", lambda_mult=0.5):
+        points = self.fetch_points()
+        contents = []
+        vectors = []
         for doc in self.reranked_docs:
-            payload = vs.retrieve_payload(doc, self.collection)
-            if isinstance(attribute, list):
-                content = ""
-                for item in attribute:
-                    value = payload.get(item, "")
-                    content += value
-            else:
-                content = payload.get(attribute, "")
-            embedding = vs.dense_embed(content)  
-
-            if cosine_similarity_filter(embedding, self.filtered_embeddings, threshold):
-                self.filtered_embeddings.append(embedding)
-                self.filtered_contents.append(content)
-
-            if len(self.filtered_contents) >= k:
-                break
-    
+            point = points.get(doc.metadata["_id"])
+            contents.append(get_content(self.payload(doc), attribute))
+            vectors.append(vs.dense_vector(point) if point else None)
+        if not contents:
+            return
+
+        # Sparse-only points carry no dense vector, embed only those (cached) contents.
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            for i, vector in zip(missing, vs.dense_embed_batch([contents[i] for i in missing])):
+                vectors[i] = vector
+        matrix = normalize_rows(vectors)
+
+        if mode == "mmr":
+            query_vector = normalize_rows([vs.dense_embed(self.query)])[0]
+            selected = mmr_select(query_vector, matrix, k, lambda_mult)
+        else:
+            selected = threshold_select(matrix, threshold, k)
+
+        self.filtered_embeddings = [matrix[i] for i in selected]
+        self.filtered_contents = [contents[i] for i in selected]
+        self.filtered_docs = [self.reranked_docs[i] for i in selected]
+
+    def passages(self, attribute):
+        # Reranked documents are scored by the cross-encoder, otherwise by the first-stage score.
+        docs = self.filtered_docs or self.reranked_docs or self.found_docs
+        score_key = "cross_score" if self.reranked_docs else "score"
+        return [
+            cb.Passage(get_content(self.payload(doc), attribute), float(doc.metadata.get(score_key, 0.0)), doc.metadata["_id"])
+            for doc in docs
+        ]
+
+def keep_scores(results):
+    docs = []
+    for doc, score in results:
+        doc.metadata["score"] = score
+        docs.append(doc)
+    return docs
+
+def get_content(payload, attribute):
+    if isinstance(attribute, list):
+        content = ""
+        for item in attribute:
+            value = payload.get(item, "")
+            content += value
+    else:
+        content = payload.get(attribute, "")
+    return content
+
+def normalize_rows(vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def threshold_select(matrix, threshold, k):
+    # Greedy in rank order: keep a candidate unless it is too similar to one already kept.
+    similarities = matrix @ matrix.T
+    max_similarity = np.full(len(matrix), -np.inf, dtype=np.float32)
+    selected = []
+    for i in range(len(matrix)):
+        if max_similarity[i] > threshold:
+            continue
+        selected.append(i)
+        if len(selected) >= k:
+            break
+        np.maximum(max_similarity, similarities[i], out=max_similarity)
+    return selected
+
+def mmr_select(query_vector, matrix, k, lambda_mult):
+    relevance = matrix @ query_vector
+    similarities = matrix @ matrix.T
+    max_similarity = np.zeros(len(matrix), dtype=np.float32)
+    available = np.ones(len(matrix), dtype=bool)
+    selected = []
+    for _ in range(min(k, len(matrix))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        i = int(np.argmax(scores))
+        selected.append(i)
+        available[i] = False
+        np.maximum(max_similarity, similarities[i], out=max_similarity)
+    return selected
+
 def cosine_similarity_filter(candidate, selected_vectors, threshold):
-    if not selected_vectors :
+    if len(selected_vectors) == 0:
         return True
-    
-    for vector in selected_vectors:
-        dot_product = np.dot(candidate, vector)
-        norm_candidate = np.linalg.norm(candidate)
-        norm_vector = np.linalg.norm(vector)
-        similarity =  dot_product / (norm_candidate * norm_vector)
-        if similarity > threshold:
-            return False
-    return True
 
+    candidate = normalize_rows([candidate])[0]
+    similarities = normalize_rows(selected_vectors) @ candidate
+    return not bool((similarities > threshold).any())
@@ -0,0 +1,104 @@
+import time
+import json
+import threading
+import numpy as np
+import config
+import vector_store as vs
+
+def scope_key(collections=(), params=None):
+    # Answers are only reused for the same collections and retrieval parameters.
+    return json.dumps({"collections": sorted(collections), "params": params or {}}, sort_keys=True, default=str)
+
+class SemanticCache:
+    def __init__(self, threshold=None, ttl=None, max_entries=None, embed=None):
+        self.threshold = threshold or config.semantic_cache_threshold
+        self.ttl = ttl or config.semantic_cache_ttl
+        self.max_entries = max_entries or config.semantic_cache_max_entries
+        self.embed = embed or vs.dense_embed
+        self.entries = []
+        self.matrix = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, query):
+        vector = np.asarray(self.embed(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _rebuild(self):
+        self.matrix = np.stack([entry["vector"] for entry in self.entries]) if self.entries else None
+
+    def _is_valid(self, entry, now):
+        if now - entry["created"] > self.ttl:
+            return False
+        return all(vs.collection_version(name) == version for name, version in entry["collections"].items())
+
+    def lookup(self, query, scope=None):
+        vector = self._vector(query)
+        now = time.time()
+        scope = scope_key() if scope is None else scope
+        with self._lock:
+            if self.matrix is not None:
+                similarities = self.matrix @ vector
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    entry = self.entries[i]
+                    if entry["scope"] == scope and self._is_valid(entry, now):
+                        entry["last_used"] = now
+                        self.hits += 1
+                        return entry
+            self.misses += 1
+        return None
+
+    def store(self, query, answer, context_ids=(), collections=(), scope=None):
+        now = time.time()
+        entry = {
+            "query": query,
+            "scope": scope_key(collections) if scope is None else scope,
+            "vector": self._vector(query),
+            "answer": answer,
+            "context_ids": list(context_ids),
+            "collections": {name: vs.collection_version(name) for name in collections},
+            "created": now,
+            "last_used": now,
+        }
+        with self._lock:
+            self.entries.append(entry)
+            self._evict(now)
+            self._rebuild()
+        return entry
+
+    def _evict(self, now):
+        self.entries = [entry for entry in self.entries if self._is_valid(entry, now)]
+        if len(self.entries) > self.max_entries:
+            self.entries.sort(key=lambda entry: entry["last_used"])
+            self.entries = self.entries[len(self.entries) - self.max_entries:]
+
+    def invalidate(self, collection_name=None):
+        with self._lock:
+            if collection_name is None:
+                self.entries = []
+            else:
+                self.entries = [entry for entry in self.entries if collection_name not in entry["collections"]]
+            self._rebuild()
+
+    def get_or_compute(self, query, compute, collections=(), params=None):
+        # compute(query) must return (answer, context_ids); params are the settings that shape the answer.
+        scope = scope_key(collections, params)
+        entry = self.lookup(query, scope)
+        if entry is not None:
+            return entry["answer"]
+        answer, context_ids = compute(query)
+        self.store(query, answer, context_ids, collections, scope)
+        return answer
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,176 +1,542 @@
-import api
-from openai import OpenAI
-from fastembed import SparseTextEmbedding
-from qdrant_client import QdrantClient, models
-from langchain_qdrant import QdrantVectorStore, RetrievalMode
+import config
 import uuid
+import json
+import functools
+import time
+import threading
+from collections import OrderedDict
 from tqdm import tqdm
 import policy as pl
+import model_registry as mr
+import embedding_cache as ec
+import manifest as mf
+import local_index
+import instrumentation as inst
+import clients
 
-openai_client = OpenAI(api_key=api.OPENAI_API)
-qdrant_client = QdrantClient(url=api.QDRANT_URL, api_key=api.QDRANT_API)
+create_client = clients.create_qdrant
 
-def dense_embed(text):
-    response = openai_client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+def set_backend(backend, path=None, client=None):
+    # Switches every vector_store function (and Retriever via get_collection) to another backend.
+    client = client or create_client(backend, path)
+    clients.set_client("qdrant", client)
+    point_cache.invalidate()
+    return client
+
+def __getattr__(name):
+    # Module-level clients used to be built at import; they are now created on first access.
+    if name == "qdrant_client":
+        return clients.qdrant()
+    if name == "openai_client":
+        return clients.openai()
+    if name == "CachedEmbeddings":
+        return cached_embeddings_class()
+    if name == "CachedSparseEmbeddings":
+        return cached_sparse_embeddings_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class PointCache:
+    def __init__(self, max_items=None):
+        self.max_items = max_items or config.point_cache_size
+        self.points = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, collection_name, point_id, with_vectors=False):
+        with self._lock:
+            point = self.points.get((collection_name, point_id))
+            if point is None or (with_vectors and point.vector is None):
+                return None
+            self.points.move_to_end((collection_name, point_id))
+            return point
+
+    def put(self, collection_name, points):
+        with self._lock:
+            for point in points:
+                self.points[(collection_name, point.id)] = point
+                self.points.move_to_end((collection_name, point.id))
+            while len(self.points) > self.max_items:
+                self.points.popitem(last=False)
+
+    def invalidate(self, collection_name=None):
+        with self._lock:
+            if collection_name is None:
+                self.points.clear()
+            else:
+                for key in [key for key in self.points if key[0] == collection_name]:
+                    del self.points[key]
+
+point_cache = PointCache()
+
+# Bumped on every write this process makes to a collection, so derived caches can tell they are stale.
+collection_versions = {}
+
+def collection_version(collection_name):
+    return collection_versions.get(collection_name, 0)
 
-def sparse_embed(text):
-    model = SparseTextEmbedding(model_name="prithivida/Splade_PP_en_v1")
-    sparse_embedding = model.embed(text)
-    return list(sparse_embedding)[0]
+def collection_changed(collection_name):
+    collection_versions[collection_name] = collection_version(collection_name) + 1
+    point_cache.invalidate(collection_name)
 
-def create_collection(collection_name, dense_embedding_dim):
-    if qdrant_client.collection_exists(collection_name=collection_name):
-        qdrant_client.delete_collection(collection_name=collection_name)
+def _embedding_cache(cache):
+    if cache is False or not config.embedding_cache_enabled:
+        return None
+    return cache or ec.default_cache()
+
+def dense_embed(text, cache=None):
+    return dense_embed_batch([text], cache=cache)[0]
+
+def sparse_embed(text, cache=None):
+    return sparse_embed_batch([text], cache=cache)[0]
+
+def create_collection(collection_name, dense_embedding_dim, client=None, recreate=True, manifest=None):
+    from qdrant_client import models
+    client = client or clients.qdrant()
+    if client.collection_exists(collection_name=collection_name):
+        if not recreate:
+            create_payload_indexes(collection_name, client)
+            print(f"Collection {collection_name} already exists, keeping it.")
+            return
+        client.delete_collection(collection_name=collection_name)
+        collection_changed(collection_name)
+        if manifest is not None:
+            for key in manifest.keys(f"{collection_name}:"):
+                manifest.remove(key)
+            manifest.save()
         print(f"Deleted old version collection {collection_name}")
 
-    qdrant_client.create_collection(
+    # One point per item holding both a named dense and a named sparse vector.
+    client.create_collection(
         collection_name=collection_name,
-        vectors_config=models.VectorParams(
-            size=dense_embedding_dim,
-            distance=models.Distance.COSINE,
-        ),
+        vectors_config={
+            config.dense_vector_name: models.VectorParams(
+                size=dense_embedding_dim,
+                distance=models.Distance.COSINE,
+            )
+        },
         sparse_vectors_config={
-            "sparse": models.SparseVectorParams()
+            config.sparse_vector_name: models.SparseVectorParams()
         }
     )
+    create_payload_indexes(collection_name, client)
     print(f"Collection {collection_name} initialized.")
 
-def add_chunk(chunks, collection_name):
-    for chunk in tqdm(chunks, desc=f"Embedding chunks and storing the embeddings."):
-        content = chunk.content
-        dense_embedding = dense_embed(content)
-        sparse_embedding = sparse_embed(content)
-
-        # dense
-        doc_id = f"{uuid.uuid4()}" 
-        qdrant_client.upsert(
+def create_payload_indexes(collection_name, client=None, payload_indexes=None):
+    from qdrant_client import models
+    client = client or clients.qdrant()
+    payload_indexes = payload_indexes or config.payload_indexes
+    for field_name, field_schema in payload_indexes.items():
+        client.create_payload_index(
             collection_name=collection_name,
-            points=[
-                models.PointStruct(
-                    id=doc_id,
-                    payload=chunk.__dict__,
-                    vector=dense_embedding
-                ),
-            ]
-        )
-        # sparse
-        doc_id = f"{uuid.uuid4()}"
-        qdrant_client.upsert(
-            collection_name=collection_name,
-            points=[
-                models.PointStruct(
-                    id=doc_id,
-                    payload=chunk.__dict__,
-                    vector={
-                        "sparse": {  
-                            "indices": list(sparse_embedding.indices),
-                            "values": list(sparse_embedding.values)
-                        }
-                    },
-                ),
-            ]
+            field_name=field_name,
+            field_schema=models.PayloadSchemaType(field_schema),
+            wait=True
         )
-    print(f"All chunks are saved to {collection_name}")
-
-def add_policies(policies:dict, collection_name):
-    for item in tqdm(policies, desc=f"Embedding policies and storing the embeddings."):
-        policy = pl.Policy.from_dict(item)
-        content = policy.policy + policy.effect
-        dense_embedding = dense_embed(content)
-        sparse_embedding = sparse_embed(content)
-
-        # dense
-        doc_id = f"{uuid.uuid4()}" 
-        qdrant_client.upsert(
-            collection_name=collection_name,
-            points=[
-                models.PointStruct(
-                    id=doc_id,
-                    payload=policy.__dict__,
-                    vector=dense_embedding
-                ),
-            ]
-        )
-        # sparse
-        doc_id = f"{uuid.uuid4()}"
-        qdrant_client.upsert(
-            collection_name=collection_name,
-            points=[
-                models.PointStruct(
-                    id=doc_id,
-                    payload=policy.__dict__,
-                    vector={
-                        "sparse": {  
-                            "indices": list(sparse_embedding.indices),
-                            "values": list(sparse_embedding.values)
-                        }
-                    },
-                ),
+
+def dense_embed_batch(texts, batch_size=None, client=None, cache=None):
+    cache = _embedding_cache(cache)
+    if cache:
+        return cache.cached(config.dense_model, texts, lambda missing: dense_embed_batch(missing, batch_size, client, cache=False))
+
+    batch_size = batch_size or config.embed_batch_size
+    client = client or clients.openai()
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        with inst.timer("embeddings.dense"):
+            response = client.embeddings.create(
+                input=texts[start:start + batch_size],
+                model=config.dense_model
+            )
+        inst.record_usage("embeddings.dense", response)
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+    return embeddings
+
+def sparse_embed_batch(texts, batch_size=None, model=None, cache=None):
+    cache = _embedding_cache(cache)
+    if cache:
+        return cache.cached(config.sparse_model, texts, lambda missing: sparse_embed_batch(missing, batch_size, model, cache=False))
+
+    batch_size = batch_size or config.embed_batch_size
+    model = model or mr.get_model("splade")
+    with inst.timer("embeddings.sparse"):
+        return list(model.embed(texts, batch_size=batch_size))
+
+def build_point(payload, dense_embedding, sparse_embedding, key=None):
+    from qdrant_client import models
+    return models.PointStruct(
+        id=mf.point_id(key) if key else f"{uuid.uuid4()}",
+        payload=payload,
+        vector={
+            config.dense_vector_name: list(dense_embedding),
+            config.sparse_vector_name: models.SparseVector(
+                indices=list(sparse_embedding.indices),
+                values=list(sparse_embedding.values)
+            )
+        }
+    )
+
+def ingest(contents, payloads, collection_name, desc="Embedding items and storing the embeddings.",
+           batch_size=None, embed_batch_size=None, upload_batch_size=None, parallel=None,
+           embedding_client=None, client=None, sparse_model=None, cache=None, keys=None):
+    batch_size = batch_size or config.ingest_batch_size
+    upload_batch_size = upload_batch_size or config.upload_batch_size
+    parallel = parallel or config.upload_workers
+    client = client or clients.qdrant()
+
+    start_time = time.perf_counter()
+    with tqdm(total=len(contents), desc=desc) as progress:
+        for start in range(0, len(contents), batch_size):
+            batch_contents = contents[start:start + batch_size]
+            batch_payloads = payloads[start:start + batch_size]
+            batch_keys = keys[start:start + batch_size] if keys else [None] * len(batch_contents)
+            dense_embeddings = dense_embed_batch(batch_contents, embed_batch_size, embedding_client, cache)
+            sparse_embeddings = sparse_embed_batch(batch_contents, embed_batch_size, sparse_model, cache)
+
+            points = [
+                build_point(payload, dense_embedding, sparse_embedding, key)
+                for payload, dense_embedding, sparse_embedding, key in zip(batch_payloads, dense_embeddings, sparse_embeddings, batch_keys)
             ]
-        )
-    print(f"All chunks are saved to {collection_name}")
+            with inst.timer("qdrant.upload_points"):
+                client.upload_points(
+                    collection_name=collection_name,
+                    points=points,
+                    batch_size=upload_batch_size,
+                    parallel=parallel,
+                    wait=True
+                )
+            inst.count("qdrant.points_uploaded", len(points))
+            progress.update(len(batch_contents))
+    if isinstance(client, local_index.LocalClient):
+        client.flush(collection_name)
+    collection_changed(collection_name)
+
+    elapsed = time.perf_counter() - start_time
+    rate = len(contents) / elapsed if elapsed > 0 else 0.0
+    print(f"{len(contents)} items are saved to {collection_name} in {elapsed:.1f}s ({rate:.1f} items/s)")
+    return rate
 
-def add_knowledges(knowledges:dict, collection_name):
-    for knowledge in tqdm(knowledges, desc=f"Embedding knowledges and storing the embeddings."):
-        content = knowledge['summary']
-        dense_embedding = dense_embed(content)
-        sparse_embedding = sparse_embed(content)
+def sync(contents, payloads, collection_name, manifest, source, client=None, **kwargs):
+    # Embeds only new or changed items and deletes points of items that disappeared from source.
+    # Items not passed in count as removed, so source must name what this call covers, e.g. one file.
+    from qdrant_client import models
+    if not source:
+        raise ValueError("sync needs a source, e.g. the file the items come from, so other sources' points are kept.")
+    client = client or clients.qdrant()
+    prefix = f"{collection_name}:{source}:"
+    current = {}
+    for content, payload in zip(contents, payloads):
+        # The key follows the embedded text, the digest also covers the payload so metadata edits are re-stored.
+        digest = mf.content_hash(content + json.dumps(payload, sort_keys=True, default=str))
+        current.setdefault(prefix + mf.content_hash(content), (content, payload, digest))
 
-        # dense
-        doc_id = f"{uuid.uuid4()}" 
-        qdrant_client.upsert(
+    removed = [key for key in manifest.keys(prefix) if key not in current]
+    if removed:
+        client.delete(
             collection_name=collection_name,
-            points=[
-                models.PointStruct(
-                    id=doc_id,
-                    payload=None,
-                    vector=dense_embedding
-                ),
-            ]
+            points_selector=models.PointIdsList(points=[point for key in removed for point in manifest.entry(key)["points"]]),
+            wait=True
         )
-        # sparse
-        doc_id = f"{uuid.uuid4()}"
-        qdrant_client.upsert(
-            collection_name=collection_name,
-            points=[
-                models.PointStruct(
-                    id=doc_id,
-                    payload=None,
-                    vector={
-                        "sparse": {  
-                            "indices": list(sparse_embedding.indices),
-                            "values": list(sparse_embedding.values)
-                        }
-                    },
-                ),
-            ]
+        for key in removed:
+            manifest.remove(key)
+        collection_changed(collection_name)
+
+    new_keys = [key for key in current if not manifest.is_done(key, current[key][2], "embedded")]
+    changed = sum(1 for key in new_keys if manifest.entry(key) is not None)
+    if new_keys:
+        # Point ids follow the key, so a changed item overwrites its old point.
+        ingest(
+            [current[key][0] for key in new_keys],
+            [current[key][1] for key in new_keys],
+            collection_name,
+            client=client,
+            keys=new_keys,
+            **kwargs
         )
-    print(f"All chunks are saved to {collection_name}")
+        for key in new_keys:
+            manifest.mark(key, current[key][2], "embedded", points=[mf.point_id(key)])
+    manifest.save()
+    print(f"{collection_name} ({source}): {len(new_keys) - changed} new, {changed} changed, {len(removed)} removed, {len(current) - len(new_keys)} unchanged")
+    return new_keys, removed
+
+def _store(contents, payloads, collection_name, desc, manifest=None, source=None, **kwargs):
+    if manifest is not None:
+        return sync(contents, payloads, collection_name, manifest, source, desc=desc, **kwargs)
+    return ingest(contents, payloads, collection_name, desc=desc, **kwargs)
+
+def add_chunk(chunks, collection_name, **kwargs):
+    contents = [chunk.content for chunk in chunks]
+    payloads = [chunk.to_dict() for chunk in chunks]
+    return _store(contents, payloads, collection_name, "Embedding chunks and storing the embeddings.", **kwargs)
+
+def add_policies(policies:dict, collection_name, **kwargs):
+    policies = [pl.Policy.from_dict(item) for item in policies]
+    contents = [policy.policy + policy.effect for policy in policies]
+    payloads = [dict(policy.__dict__) for policy in policies]
+    return _store(contents, payloads, collection_name, "Embedding policies and storing the embeddings.", **kwargs)
+
+def add_knowledges(knowledges:dict, collection_name, **kwargs):
+    contents = [knowledge['summary'] for knowledge in knowledges]
+    payloads = [dict(knowledge) for knowledge in knowledges]
+    return _store(contents, payloads, collection_name, "Embedding knowledges and storing the embeddings.", **kwargs)
+
+# The LangChain base classes are slow to import, so the wrappers are defined on first use.
+@functools.lru_cache(maxsize=None)
+def cached_embeddings_class():
+    from langchain_core.embeddings import Embeddings
+
+    class CachedEmbeddings(Embeddings):
+        def __init__(self, embedding_function, model_name, cache=None):
+            self.embedding_function = embedding_function
+            self.model_name = model_name
+            self.cache = cache
+
+        def embed_documents(self, texts):
+            return _embedding_cache(self.cache).cached(self.model_name, texts, self.embedding_function.embed_documents)
+
+        def embed_query(self, text):
+            compute = lambda missing: [self.embedding_function.embed_query(t) for t in missing]
+            return _embedding_cache(self.cache).cached(f"{self.model_name}:query", [text], compute)[0]
+
+    return CachedEmbeddings
+
+@functools.lru_cache(maxsize=None)
+def cached_sparse_embeddings_class():
+    from langchain_qdrant import SparseEmbeddings, SparseVector
+
+    class CachedSparseEmbeddings(SparseEmbeddings):
+        def __init__(self, embedding_function, model_name, cache=None):
+            self.embedding_function = embedding_function
+            self.model_name = model_name
+            self.cache = cache
+
+        def embed_documents(self, texts):
+            embeddings = _embedding_cache(self.cache).cached(self.model_name, texts, self.embedding_function.embed_documents)
+            return [SparseVector(indices=list(e.indices), values=list(e.values)) for e in embeddings]
 
-def get_collection(collection_name, dense_embedding_function, sparse_embedding_function, retrieval_mode=RetrievalMode.HYBRID):
-    collection = QdrantVectorStore.from_existing_collection(
+        def embed_query(self, text):
+            compute = lambda missing: [self.embedding_function.embed_query(t) for t in missing]
+            embedding = _embedding_cache(self.cache).cached(f"{self.model_name}:query", [text], compute)[0]
+            return SparseVector(indices=list(embedding.indices), values=list(embedding.values))
+
+    return CachedSparseEmbeddings
+
+def get_collection(collection_name, dense_embedding_function, sparse_embedding_function=None, retrieval_mode=None):
+    from langchain_qdrant import QdrantVectorStore, RetrievalMode
+    retrieval_mode = retrieval_mode or RetrievalMode.HYBRID
+    qdrant_client = clients.qdrant()
+    sparse_embedding_function = sparse_embedding_function or mr.get_model("fastembed_sparse")
+    if _embedding_cache(None):
+        dense_model = getattr(dense_embedding_function, "model", config.dense_model)
+        sparse_model = getattr(sparse_embedding_function, "model_name", config.sparse_model)
+        dense_embedding_function = cached_embeddings_class()(dense_embedding_function, dense_model)
+        sparse_embedding_function = cached_sparse_embeddings_class()(sparse_embedding_function, sparse_model)
+    if isinstance(qdrant_client, local_index.LocalClient):
+        return local_index.LocalCollection(qdrant_client, collection_name, dense_embedding_function, sparse_embedding_function, retrieval_mode)
+    vector_name = config.dense_vector_name
+    if not is_hybrid_layout(collection_name, qdrant_client):
+        vector_name = ""
+        print(f"Collection {collection_name} stores dense and sparse vectors as separate points; run migrate.py {collection_name} to merge them.")
+    collection = QdrantVectorStore(
+        client=qdrant_client,
         embedding=dense_embedding_function,
         sparse_embedding=sparse_embedding_function,
         collection_name=collection_name,
-        url=api.QDRANT_URL,
-        api_key=api.QDRANT_API,
         retrieval_mode=retrieval_mode,
-        sparse_vector_name="sparse"
+        vector_name=vector_name,
+        sparse_vector_name=config.sparse_vector_name
     )
     return collection
 
+def fusion_query(fusion=None):
+    # Passed as hybrid_fusion so Qdrant fuses the dense and sparse prefetches server-side.
+    from qdrant_client import models
+    return models.FusionQuery(fusion=models.Fusion((fusion or config.hybrid_fusion).lower()))
+
+def is_hybrid_layout(collection_name, client=None):
+    client = client or clients.qdrant()
+    if isinstance(client, local_index.LocalClient):
+        return client.get_index(collection_name).dense_name == config.dense_vector_name
+    vectors = client.get_collection(collection_name).config.params.vectors
+    return isinstance(vectors, dict) and config.dense_vector_name in vectors
+
+def scroll_points(collection_name, client=None, batch_size=256):
+    client = client or clients.qdrant()
+    offset = None
+    while True:
+        records, offset = client.scroll(collection_name=collection_name, limit=batch_size, offset=offset, with_payload=True, with_vectors=True)
+        yield from records
+        if offset is None:
+            return
+
+def _vector_parts(vector):
+    # Legacy points carry either an unnamed dense vector or a {"sparse": ...} vector; migrated ones carry both.
+    if not isinstance(vector, dict):
+        return vector, None
+    from qdrant_client import models
+    dense = vector.get(config.dense_vector_name, vector.get(""))
+    sparse = vector.get(config.sparse_vector_name, vector.get("sparse"))
+    if sparse is not None and not isinstance(sparse, models.SparseVector):
+        # The local backend returns plain records; rebuild them so they validate as PointStruct vectors.
+        sparse = models.SparseVector(indices=list(sparse.indices), values=list(sparse.values))
+    return dense, sparse
+
+def find_twins(records, manifest_pairs=None):
+    # Maps each half of a legacy dense/sparse pair to the other. Manifest pairs are exact; otherwise halves are
+    # paired by payload, but only when it is non-empty and exactly one dense and one sparse point carry it.
+    partners = {}
+    for dense_id, sparse_id in (manifest_pairs or []):
+        partners[str(dense_id)] = str(sparse_id)
+        partners[str(sparse_id)] = str(dense_id)
+    groups = {}
+    for record in records:
+        dense, sparse = _vector_parts(record.vector)
+        if (dense is None) == (sparse is None) or not record.payload or str(record.id) in partners:
+            continue
+        halves = groups.setdefault(json.dumps(record.payload, sort_keys=True, default=str), ([], []))
+        halves[0 if dense is not None else 1].append(str(record.id))
+    for dense_ids, sparse_ids in groups.values():
+        if len(dense_ids) == 1 and len(sparse_ids) == 1:
+            partners[dense_ids[0]] = sparse_ids[0]
+            partners[sparse_ids[0]] = dense_ids[0]
+    return partners
+
+def merge_twin_points(records, partners, manifest_ids=None):
+    # Joins the halves found by find_twins; everything else is copied as it is.
+    from qdrant_client import models
+    manifest_ids = manifest_ids or {}
+    pending = {}
+    merged = 0
+    unpaired = 0
+    for record in records:
+        dense, sparse = _vector_parts(record.vector)
+        if dense is not None and sparse is not None:
+            yield models.PointStruct(id=record.id, payload=record.payload, vector={config.dense_vector_name: dense, config.sparse_vector_name: sparse})
+            continue
+        partner = partners.get(str(record.id))
+        if partner is None:
+            unpaired += 1
+            vector_name = config.dense_vector_name if dense is not None else config.sparse_vector_name
+            yield models.PointStruct(id=manifest_ids.get(str(record.id), record.id), payload=record.payload, vector={vector_name: dense if dense is not None else sparse})
+            continue
+        if partner not in pending:
+            pending[str(record.id)] = (record, dense, sparse)
+            continue
+        other, other_dense, other_sparse = pending.pop(partner)
+        dense_record = record if dense is not None else other
+        merged += 1
+        yield models.PointStruct(
+            id=manifest_ids.get(str(dense_record.id), dense_record.id),
+            payload=dense_record.payload or (other if dense_record is record else record).payload,
+            vector={config.dense_vector_name: dense if dense is not None else other_dense, config.sparse_vector_name: sparse if sparse is not None else other_sparse}
+        )
+    print(f"Merged {merged} dense/sparse twins, {unpaired} points had no unambiguous twin and were kept as they are.")
+    if unpaired:
+        print("Points with an empty or shared payload cannot be paired safely; re-ingest those items to get hybrid points.")
+
+def _copy_points(points, collection_name, client, batch_size):
+    batch = []
+    copied = 0
+    for point in points:
+        batch.append(point)
+        if len(batch) == batch_size:
+            client.upload_points(collection_name=collection_name, points=batch, wait=True)
+            copied += len(batch)
+            batch = []
+    if batch:
+        client.upload_points(collection_name=collection_name, points=batch, wait=True)
+        copied += len(batch)
+    if isinstance(client, local_index.LocalClient):
+        client.flush(collection_name)
+    return copied
+
+def _dense_dim(collection_name, client, batch_size):
+    for record in scroll_points(collection_name, client, batch_size):
+        dense, _ = _vector_parts(record.vector)
+        if dense is not None:
+            return len(dense)
+    return None
+
+def migrate_collection(collection_name, client=None, manifest=None, batch_size=256):
+    # Rewrites a legacy two-points-per-item collection into the single-point layout without re-embedding.
+    # Merged points go to a staging collection first, so a crash never leaves the only copy half written.
+    client = client or clients.qdrant()
+    staging = f"{collection_name}__migrating"
+    if client.collection_exists(collection_name=staging) and client.collection_exists(collection_name=collection_name) and not is_hybrid_layout(collection_name, client):
+        # The staging copy of an interrupted first pass is incomplete; start over.
+        client.delete_collection(collection_name=staging)
+    if not client.collection_exists(collection_name=staging):
+        if is_hybrid_layout(collection_name, client):
+            print(f"Collection {collection_name} already uses the single-point layout.")
+            return 0
+        manifest_ids = {}
+        manifest_pairs = []
+        if manifest is not None:
+            for key in manifest.keys(f"{collection_name}:"):
+                points = manifest.entry(key).get("points") or []
+                if points:
+                    manifest_ids[str(points[0])] = mf.point_id(key)
+                if len(points) == 2:
+                    manifest_pairs.append(points)
+        dim = _dense_dim(collection_name, client, batch_size)
+        if dim is None:
+            raise ValueError(f"Collection {collection_name} has no dense vectors to take the dimension from.")
+        create_collection(staging, dim, client=client)
+        # Two passes: pairs are decided over the whole collection before anything is merged.
+        partners = find_twins(scroll_points(collection_name, client, batch_size), manifest_pairs)
+        copied = _copy_points(merge_twin_points(scroll_points(collection_name, client, batch_size), partners, manifest_ids), staging, client, batch_size)
+        print(f"{copied} points written to {staging}")
+        client.delete_collection(collection_name=collection_name)
+
+    # Copy back under the original name; a crash here is resumed from the staging collection.
+    # Unpaired sparse-only points carry no dense vector, so scan until one does before dropping anything.
+    dim = _dense_dim(staging, client, batch_size)
+    if dim is None:
+        raise ValueError(f"Staging collection {staging} has no dense vectors to take the dimension from.")
+    if client.collection_exists(collection_name=collection_name):
+        client.delete_collection(collection_name=collection_name)
+    create_collection(collection_name, dim, client=client)
+    copied = _copy_points(scroll_points(staging, client, batch_size), collection_name, client, batch_size)
+    client.delete_collection(collection_name=staging)
+    collection_changed(collection_name)
+    if manifest is not None:
+        for key in manifest.keys(f"{collection_name}:"):
+            manifest.entry(key)["points"] = [mf.point_id(key)]
+        manifest.save()
+    print(f"Collection {collection_name} migrated: {copied} points.")
+    return copied
+
 def retrieve_payload(document, collection):
-    point_id = document.metadata["_id"]
-    point = qdrant_client.retrieve(
-        collection_name=collection.collection_name,
-        ids=[point_id],
-        with_payload=True,  
-        with_vectors=False  
-    )
-    payload = point[0].payload
-    return payload
+    point = retrieve_points([document], collection).get(document.metadata["_id"])
+    return point.payload if point else None
+
+def retrieve_points(documents, collection, with_vectors=False):
+    collection_name = collection.collection_name
+    point_ids = list(dict.fromkeys(document.metadata["_id"] for document in documents))
+    points = {}
+    missing = []
+    for point_id in point_ids:
+        point = point_cache.get(collection_name, point_id, with_vectors)
+        if point is None:
+            missing.append(point_id)
+        else:
+            points[point_id] = point
+
+    inst.count("point_cache.hits", len(point_ids) - len(missing))
+    if missing:
+        with inst.timer("qdrant.retrieve"):
+            fetched = clients.qdrant().retrieve(
+                collection_name=collection_name,
+                ids=missing,
+                with_payload=True,
+                with_vectors=with_vectors
+            )
+        point_cache.put(collection_name, fetched)
+        points.update((point.id, point) for point in fetched)
+    return points
 
+def dense_vector(point):
+    vector = point.vector
+    if isinstance(vector, dict):
+        vector = vector.get(config.dense_vector_name, vector.get(""))
+    if isinstance(vector, list):
+        return vector
+    return None